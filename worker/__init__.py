@@ -8,6 +8,9 @@ import multiprocessing
 import signal
 import time
 import traceback
+import threading
+import importlib
+import gc
 
 # 3rd-party Modules
 import psutil
@@ -53,6 +56,13 @@ MAIN_PROCESS      = None
 CHILD_PROCESS_MAP = {} # PID -> Process
 HEARTBEAT_COUNT   = 0
 
+# Usage of CPU / Memory sampled in heartbeat
+SYS_USAGE = {
+    'cpuPercent'      : None,
+    'memoryPSS'       : None,
+    'processMemoryPSS': None, # Average of Worker processes
+}
+
 exec_filename = os.path.basename(sys.argv[0])
 if exec_filename == 'app.py':
     LISTINGING_QUEUES = sys.argv[1:]
@@ -100,13 +110,254 @@ def check_sys_db(logger, db, interval=None):
         e = SysDBCheckException(f'System DB check failed: {repr(e)}')
         raise e
 
-def check_restart_flag(global_context):
+class SysHealthChecker(object):
+    '''
+    Check system Redis / DB in a background thread of the Worker process
+    1. Successful operations on system Redis / DB count as passed checks
+    2. Probe explicitly only after a failed operation or an idle period
+    3. A probe not finished within the timeout counts as failed
+    '''
+    def __init__(self, logger, cache_db, db):
+        self.logger = logger
+
+        self.checks = [
+            {
+                'title'    : 'Redis',
+                'helper'   : cache_db,
+                'probe'    : cache_db.check if cache_db else None,
+                'interval' : CONFIG['_SYS_REDIS_CHECK_INTERVAL'],
+                'timeout'  : CONFIG['_SYS_REDIS_CHECK_TIMEOUT'],
+                'exception': SysRedisCheckException,
+            },
+            {
+                'title'    : 'DB',
+                'helper'   : db,
+                # Probe with a dedicated connection, the pooled one may be held by Tasks
+                'probe'    : db.probe if db else None,
+                'interval' : CONFIG['_SYS_DB_CHECK_INTERVAL'],
+                'timeout'  : CONFIG['_SYS_DB_CHECK_TIMEOUT'],
+                'exception': SysDBCheckException,
+            },
+        ]
+
+        for check in self.checks:
+            check['probeStartTime'] = None
+            check['lastProbeTime']  = 0
+            check['error']          = None
+
+    def start(self):
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def _is_probe_needed(self, check, now):
+        client_status = check['helper'].client_status
+
+        # Failed after the last success
+        if client_status['lastErrorTime'] > client_status['lastOkTime']:
+            return True
+
+        # Idle for a while
+        last_ok_time = max(client_status['lastOkTime'], check['lastProbeTime'])
+        return now - last_ok_time >= check['interval']
+
+    def _run(self):
+        while True:
+            time.sleep(1)
+
+            for check in self.checks:
+                if not check['helper'] or check['error']:
+                    continue
+
+                now = time.time()
+                if not self._is_probe_needed(check, now):
+                    continue
+
+                check['probeStartTime'] = now
+                try:
+                    check['probe']()
+
+                except Exception as e:
+                    check['error'] = e
+
+                finally:
+                    check['probeStartTime'] = None
+                    check['lastProbeTime']  = now
+
+    def raise_for_status(self):
+        now = time.time()
+        for check in self.checks:
+            if check['error']:
+                e = check['exception'](f'System {check["title"]} check failed: {repr(check["error"])}')
+                raise e
+
+            probe_start_time = check['probeStartTime']
+            if probe_start_time and now - probe_start_time > check['timeout']:
+                e = check['exception'](f'System {check["title"]} check timeout')
+                raise e
+
+class QueueFetchStats(object):
+    '''
+    Fetch count and total wait time of each queue in a Worker process
+    Only written by the Worker process and read by the main process, so no lock is needed
+    '''
+    # Readers in the main process, each one gets the stats since its own last collection
+    CONSUMERS = [ 'heartbeat', 'autoscale' ]
+
+    def __init__(self):
+        queue_count = CONFIG['_WORKER_QUEUE_COUNT']
+
+        self.fetch_count   = multiprocessing.RawArray('q', queue_count)
+        self.wait_ms_total = multiprocessing.RawArray('q', queue_count)
+
+        # Values at the last collection of each consumer (in main process)
+        self._collected = dict([ (consumer, ([ 0 ] * queue_count, [ 0 ] * queue_count)) for consumer in self.CONSUMERS ])
+
+    def record(self, queue, wait_ms):
+        if queue < 0 or queue >= len(self.fetch_count):
+            return
+
+        self.wait_ms_total[queue] += max(int(wait_ms), 0)
+        self.fetch_count[queue]   += 1
+
+    def collect(self, consumer):
+        '''
+        Get fetch count and total wait time of each queue since the last collection of the consumer
+        '''
+        collected_fetch_count, collected_wait_ms_total = self._collected[consumer]
+
+        collected = {}
+        for q in range(len(self.fetch_count)):
+            fetch_count   = self.fetch_count[q]
+            wait_ms_total = self.wait_ms_total[q]
+
+            if fetch_count <= collected_fetch_count[q]:
+                continue
+
+            collected[q] = (fetch_count   - collected_fetch_count[q],
+                            wait_ms_total - collected_wait_ms_total[q])
+
+            collected_fetch_count[q]   = fetch_count
+            collected_wait_ms_total[q] = wait_ms_total
+
+        return collected
+
+class WorkerContext(object):
+    '''
+    Context shared between the main process and Worker processes
+    Flags are stored in shared memory, so checking them in Worker processes costs no IPC
+    '''
+    SHUTDOWN_EVENTS = [
+        None,
+        'restartFlag',
+        'signal',
+        'keyboard',
+        'sysRedisCheck',
+        'sysDBCheck',
+        'unexpectedError',
+    ]
+
+    def __init__(self):
+        self._shutdown_event = multiprocessing.RawValue('i', 0)
+        self._signal_num     = multiprocessing.RawValue('i', 0)
+
+        # Prev tick time of Beat, kept across Beat process restarts
+        self.prev_tick_time = multiprocessing.RawValue('q', 0)
+
+        # Current number of Worker processes (in main process)
+        self.pool_size = None
+
+        # Shared counter of each Worker process (used by the app as needed)
+        # NOTE Created before forking, so the Worker process gets its own one as `process_counter`
+        self.process_counter     = None
+        self.process_counter_map = {} # PID -> Counter
+
+        # Retire flag of each Worker process, the Worker process exits after the current task once set
+        # NOTE Same as `process_counter`, the Worker process gets its own one as `process_retire_flag`
+        self.process_retire_flag     = None
+        self.process_retire_flag_map = {} # PID -> Flag
+
+        # Fetch stats of each Worker process
+        # NOTE Same as `process_counter`, the Worker process gets its own one as `queue_fetch_stats`
+        self.queue_fetch_stats     = None
+        self.queue_fetch_stats_map = {} # PID -> Stats
+
+        # Stats of exited Worker processes not collected yet by each consumer
+        self._exited_queue_fetch_stats = dict([ (consumer, {}) for consumer in QueueFetchStats.CONSUMERS ])
+
+    @property
+    def shutdown_event(self):
+        return self.SHUTDOWN_EVENTS[self._shutdown_event.value]
+
+    @shutdown_event.setter
+    def shutdown_event(self, shutdown_event):
+        self._shutdown_event.value = self.SHUTDOWN_EVENTS.index(shutdown_event)
+
+    @property
+    def signal_name(self):
+        if not self._signal_num.value:
+            return None
+
+        return signal.Signals(self._signal_num.value).name
+
+    @signal_name.setter
+    def signal_name(self, signal_name):
+        self._signal_num.value = signal.Signals[signal_name].value
+
+    def create_process_counter(self):
+        self.process_counter = multiprocessing.RawValue('i', 0)
+        return self.process_counter
+
+    def create_process_retire_flag(self):
+        self.process_retire_flag = multiprocessing.RawValue('b', 0)
+        return self.process_retire_flag
+
+    def retire_process(self, pid):
+        flag = self.process_retire_flag_map.get(pid)
+        if flag is not None:
+            flag.value = 1
+
+    def create_queue_fetch_stats(self):
+        self.queue_fetch_stats = QueueFetchStats()
+        return self.queue_fetch_stats
+
+    def remove_queue_fetch_stats(self, pid):
+        stats = self.queue_fetch_stats_map.pop(pid, None)
+        if stats is None:
+            return
+
+        for consumer, exited in self._exited_queue_fetch_stats.items():
+            for q, (fetch_count, wait_ms_total) in stats.collect(consumer).items():
+                prev_fetch_count, prev_wait_ms_total = exited.get(q) or (0, 0)
+                exited[q] = (prev_fetch_count + fetch_count, prev_wait_ms_total + wait_ms_total)
+
+    def collect_queue_fetch_stats(self, consumer):
+        '''
+        Get fetch count and total wait time of each queue of all Worker processes since the last collection of the consumer
+        '''
+        collected = self._exited_queue_fetch_stats[consumer]
+        self._exited_queue_fetch_stats[consumer] = {}
+
+        for stats in self.queue_fetch_stats_map.values():
+            for q, (fetch_count, wait_ms_total) in stats.collect(consumer).items():
+                prev_fetch_count, prev_wait_ms_total = collected.get(q) or (0, 0)
+                collected[q] = (prev_fetch_count + fetch_count, prev_wait_ms_total + wait_ms_total)
+
+        return collected
+
+    def get_process_counter(self, pid):
+        counter = self.process_counter_map.get(pid)
+        if counter is None:
+            return 0
+
+        return counter.value
+
+def check_restart_flag(context):
     # Limit
     if not toolkit.TriggerLimit.is_free('restartFlag', CONFIG['_RESTART_FLAG_CHECK_INTERVAL']):
         return
 
     # Non-duplication of checks
-    if global_context.get('shutdownEvent'):
+    if context.shutdown_event:
         return
 
     cache_key = toolkit.get_global_cache_key('tempFlag', 'restartAllWorkersAndBeat')
@@ -120,9 +371,9 @@ def check_restart_flag(global_context):
         return
 
     LOGGER.warning(f'Flag `restartAllWorkersAndBeat` is set at {toolkit.to_iso_datetime(restart_flag_time)}, all Workers and Beat will exit soon...')
-    global_context['shutdownEvent'] = 'restartFlag'
+    context.shutdown_event = 'restartFlag'
 
-def heartbeat():
+def heartbeat(context):
     # Limit
     if not toolkit.TriggerLimit.is_free('heartbeat', CONFIG['_HEARTBEAT_INTERVAL']):
         return
@@ -169,13 +420,25 @@ def heartbeat():
 
     # Record the number of workers/processes per queue
     if LISTINGING_QUEUES and WORKER_ID:
+        queue_fetch_stats = context.collect_queue_fetch_stats('heartbeat')
+
         for q in LISTINGING_QUEUES:
             # Record the number of worker processes in this queue.
             cache_key = toolkit.get_monitor_cache_key('heartbeat', 'workerOnQueue')
             queue_worker_id = toolkit.get_colon_tags(['workerQueue', q, 'workerId', WORKER_ID])
-            cache_data = { 'ts': now, 'processCount': CONFIG['_WORKER_CONCURRENCY'] }
+            cache_data = { 'ts': now, 'processCount': context.pool_size or CONFIG['_WORKER_CONCURRENCY'] }
             CACHE_DB.hset(cache_key, queue_worker_id, toolkit.json_dumps(cache_data))
 
+            # Record the number of fetched tasks and the average wait time in this queue since the last heartbeat.
+            fetch_count, wait_ms_total = queue_fetch_stats.get(q) or (0, 0)
+            wait_cache_key = toolkit.get_monitor_cache_key('heartbeat', 'queueWaitOnWorker')
+            wait_cache_data = {
+                'ts'        : now,
+                'fetchCount': fetch_count,
+                'avgWaitMs' : int(wait_ms_total / fetch_count) if fetch_count else 0,
+            }
+            CACHE_DB.hset(wait_cache_key, queue_worker_id, toolkit.json_dumps(wait_cache_data))
+
             # Reload the number of processes of all workers in this queue.
             queue_worker_id_pattern = toolkit.get_colon_tags(['workerQueue', q, 'workerId', '*'])
             worker_process_count_map = CACHE_DB.hget_pattern_expires(cache_key, queue_worker_id_pattern, CONFIG['_MONITOR_REPORT_EXPIRES'])
@@ -221,10 +484,16 @@ def heartbeat():
             CHILD_PROCESS_MAP[pid] = p
 
     # Statistics
+    child_memory_pss    = 0
+    child_process_count = 0
     for p in CHILD_PROCESS_MAP.values():
         try:
             total_cpu_percent += p.cpu_percent()
-            total_memory_pss  += p.memory_full_info().pss
+
+            process_memory_pss   = p.memory_full_info().pss
+            total_memory_pss    += process_memory_pss
+            child_memory_pss    += process_memory_pss
+            child_process_count += 1
 
         except psutil.ZombieProcess as e:
             pass
@@ -232,15 +501,104 @@ def heartbeat():
     hostname          = socket.gethostname()
     total_cpu_percent = round(total_cpu_percent, 2)
 
+    SYS_USAGE['cpuPercent']       = total_cpu_percent
+    SYS_USAGE['memoryPSS']        = total_memory_pss
+    SYS_USAGE['processMemoryPSS'] = int(child_memory_pss / child_process_count) if child_process_count else None
+
     cache_key = toolkit.get_monitor_cache_key('monitor', 'systemMetrics', [ 'metric', 'workerCPUPercent', 'hostname', hostname ])
     CACHE_DB.ts_add(cache_key, total_cpu_percent, timestamp=now)
 
     cache_key = toolkit.get_monitor_cache_key('monitor', 'systemMetrics', [ 'metric', 'workerMemoryPSS', 'hostname', hostname ])
     CACHE_DB.ts_add(cache_key, total_memory_pss, timestamp=now)
 
-def run_background(func, pool_size=1, max_tasks=-1):
-    manager = multiprocessing.Manager()
-    global_context = manager.dict()
+class WorkerAutoScaler(object):
+    '''
+    Adjust the number of Worker processes between min and max
+    1. Scale up when tasks are waiting in the listened queues (backlog or long wait time)
+    2. Scale down one by one when the listened queues are idle
+    3. Limited by CPU / memory limits of the container (cgroup), and CPU / PSS usage sampled in heartbeat
+    '''
+    def __init__(self, min_size, max_size):
+        self.min_size = max(int(min_size), 1)
+        self.max_size = max(int(max_size), self.min_size)
+
+        self.cpu_limit    = toolkit.get_cpu_limit()
+        self.memory_limit = toolkit.get_memory_limit()
+
+    def get_initial_pool_size(self, pool_size):
+        return min(max(pool_size, self.min_size), self.max_size)
+
+    def get_max_pool_size(self, pool_size):
+        max_pool_size = self.max_size
+
+        # No more processes when CPU is almost used up
+        cpu_percent = SYS_USAGE['cpuPercent']
+        if cpu_percent is not None and cpu_percent >= self.cpu_limit * 100 * CONFIG['_WORKER_AUTOSCALE_CPU_RATIO']:
+            max_pool_size = min(max_pool_size, pool_size)
+
+        # Memory for more processes, estimated by PSS of current processes
+        memory_pss         = SYS_USAGE['memoryPSS']
+        process_memory_pss = SYS_USAGE['processMemoryPSS']
+        if memory_pss and process_memory_pss:
+            free_memory = self.memory_limit * CONFIG['_WORKER_AUTOSCALE_MEMORY_RATIO'] - memory_pss
+            max_pool_size = min(max_pool_size, pool_size + max(int(free_memory / process_memory_pss), 0))
+
+        return max(max_pool_size, self.min_size)
+
+    def get_pool_size(self, context, pool_size):
+        # Limit
+        if not toolkit.TriggerLimit.is_free('workerAutoscale', CONFIG['_WORKER_AUTOSCALE_INTERVAL']):
+            return pool_size
+
+        # Average wait time since the last check
+        fetch_count   = 0
+        wait_ms_total = 0
+        for q, (_fetch_count, _wait_ms_total) in context.collect_queue_fetch_stats('autoscale').items():
+            fetch_count   += _fetch_count
+            wait_ms_total += _wait_ms_total
+
+        avg_wait_ms = int(wait_ms_total / fetch_count) if fetch_count else 0
+
+        # Backlog of listened queues
+        CACHE_DB.begin_pipeline()
+        for q in LISTINGING_QUEUES:
+            CACHE_DB.llen(toolkit.get_worker_queue(q))
+
+        backlog = sum([ int(x or 0) for x in CACHE_DB.execute_pipeline() ])
+
+        next_pool_size = pool_size
+        if backlog > 0 and (backlog >= pool_size or avg_wait_ms >= CONFIG['_WORKER_AUTOSCALE_WAIT_MS']):
+            # Busy, scale up by half
+            next_pool_size = min(pool_size + max(pool_size // 2, 1), self.get_max_pool_size(pool_size))
+
+        elif backlog == 0 and fetch_count < pool_size:
+            # Idle, scale down one by one
+            next_pool_size = pool_size - 1
+
+        next_pool_size = min(max(next_pool_size, self.min_size), self.max_size)
+        if next_pool_size != pool_size:
+            LOGGER.info(f'[AUTOSCALE] Worker processes: {pool_size} -> {next_pool_size} (backlog={backlog}, avgWaitMs={avg_wait_ms}, fetchCount={fetch_count})')
+
+        return next_pool_size
+
+def prepare_fork_template():
+    '''
+    Warm up the main process as the template of Worker processes
+    1. Pre-import modules which are imported lazily in Worker processes (e.g. connector libraries)
+    2. Freeze all existing objects, so the forked Worker processes share their memory pages (copy-on-write)
+    '''
+    for module_name in CONFIG['_WORKER_PRELOAD_MODULE_LIST']:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            LOGGER.warning(f'Preload module `{module_name}` failed: {repr(e)}')
+
+    if CONFIG['_WORKER_PRELOAD_GC_FREEZE']:
+        gc.collect()
+        gc.freeze()
+
+def run_background(func, pool_size=1, max_tasks=-1, on_process_exit=None, on_loop_exit=None, autoscaler=None):
+    context = WorkerContext()
 
     try:
         # Signal handler
@@ -248,8 +606,8 @@ def run_background(func, pool_size=1, max_tasks=-1):
             signal_name = signal.Signals(signum).name
             LOGGER.warning(f'Received {signal_name}')
 
-            global_context['shutdownEvent'] = 'signal'
-            global_context['signalName']    = signal_name
+            context.shutdown_event = 'signal'
+            context.signal_name    = signal_name
 
         signal.signal(signal.SIGTERM, signal_handler)
 
@@ -257,80 +615,127 @@ def run_background(func, pool_size=1, max_tasks=-1):
         def func_wrap(context):
             _LOGGER, _CACHE_DB, _DB = get_sys_helpers()
 
+            # Check system Redis / DB in background
+            health_checker = SysHealthChecker(_LOGGER, _CACHE_DB, _DB)
+            health_checker.start()
+
             # Restarting the process after running a number of tasks
             ran_tasks = 0
             while max_tasks <= 0 or ran_tasks <= max_tasks:
                 try:
-                    # Check system Redis
-                    check_sys_redis(_LOGGER, _CACHE_DB)
-
-                    # Check system DB
-                    check_sys_db(_LOGGER, _DB)
+                    # Check system Redis / DB
+                    # NOTE Only read the result of background checks, no round trip here
+                    health_checker.raise_for_status()
 
                     # Check stop events
-                    if global_context.get('shutdownEvent'):
+                    if context.shutdown_event:
                         _LOGGER.warning('Shutdown Event is set, Task Loop exit')
                         break
 
+                    # Check retire flag
+                    if context.process_retire_flag.value:
+                        _LOGGER.info('Process is retired, Task Loop exit')
+                        break
+
                     # Run the specified Func
                     ran_tasks += 1
                     func(context)
 
                 except KeyboardInterrupt as e:
-                    global_context['shutdownEvent'] = 'keyboard'
+                    context.shutdown_event = 'keyboard'
 
                 except SysRedisCheckException as e:
-                    global_context['shutdownEvent'] = 'sysRedisCheck'
+                    context.shutdown_event = 'sysRedisCheck'
 
                 except SysDBCheckException as e:
-                    global_context['shutdownEvent'] = 'sysDBCheck'
+                    context.shutdown_event = 'sysDBCheck'
 
                 except Exception as e:
                     raise
 
+            # Clean up before the process exits
+            if on_loop_exit:
+                on_loop_exit(context)
+
         # Keep the number of running processes
         pool = []
+        retiring_pids = set()
         worker_process_seq = 0
+
+        if autoscaler:
+            pool_size = autoscaler.get_initial_pool_size(pool_size)
+
+        context.pool_size = pool_size
+
         while True:
             # Check system Redis
             check_sys_redis(LOGGER, CACHE_DB, interval=CONFIG['_SYS_REDIS_CHECK_INTERVAL'])
 
             # Check restart flag
-            check_restart_flag(global_context)
+            check_restart_flag(context)
 
             # Heartbeat
-            heartbeat()
+            heartbeat(context)
 
-            if global_context.get('shutdownEvent'):
+            if context.shutdown_event:
                 LOGGER.warning('Shutdown Event is set, Process Pool Loop exit')
                 break
 
-            for p in pool:
+            for p in list(pool):
                 if not p.is_alive():
                     p.join(10)
                     pool.remove(p)
 
-            while len(pool) < pool_size:
-                p = multiprocessing.Process(name=f'WorkerProc-{worker_process_seq}', target=func_wrap, args=[ global_context ])
+                    if on_process_exit:
+                        on_process_exit(context, p.pid)
+
+                    context.process_counter_map.pop(p.pid, None)
+                    context.process_retire_flag_map.pop(p.pid, None)
+                    context.remove_queue_fetch_stats(p.pid)
+
+                    retiring_pids.discard(p.pid)
+
+            # Adjust the number of processes
+            if autoscaler:
+                pool_size = autoscaler.get_pool_size(context, pool_size)
+                context.pool_size = pool_size
+
+            # Retire extra processes, they exit after the current task
+            active_pool = [ p for p in pool if p.pid not in retiring_pids ]
+            for p in active_pool[pool_size:]:
+                context.retire_process(p.pid)
+                retiring_pids.add(p.pid)
+
+            while len(pool) - len(retiring_pids) < pool_size:
+                process_counter     = context.create_process_counter()
+                process_retire_flag = context.create_process_retire_flag()
+                queue_fetch_stats   = context.create_queue_fetch_stats()
+
+                # NOTE Always fork from the warmed main process
+                p = multiprocessing.get_context('fork').Process(name=f'WorkerProc-{worker_process_seq}', target=func_wrap, args=[ context ])
                 p.start()
                 pool.append(p)
 
+                context.process_counter_map[p.pid]     = process_counter
+                context.process_retire_flag_map[p.pid] = process_retire_flag
+                context.queue_fetch_stats_map[p.pid]   = queue_fetch_stats
+
                 worker_process_seq += 1
 
             # Wait
             time.sleep(1)
 
     except KeyboardInterrupt as e:
-        global_context['shutdownEvent'] = 'keyboard'
+        context.shutdown_event = 'keyboard'
 
     except SysRedisCheckException as e:
-        global_context['shutdownEvent'] = 'sysRedisCheck'
+        context.shutdown_event = 'sysRedisCheck'
 
     except SysDBCheckException as e:
-        global_context['shutdownEvent'] = 'sysDBCheck'
+        context.shutdown_event = 'sysDBCheck'
 
     except Exception as e:
-        global_context['shutdownEvent'] = 'unexpectedError'
+        context.shutdown_event = 'unexpectedError'
 
         LOGGER.error(f'Unexpected: {repr(e)}')
         for line in traceback.format_exc().splitlines():
@@ -344,12 +749,18 @@ def run_background(func, pool_size=1, max_tasks=-1):
             LOGGER.warning(f'Kill Process: {p}')
             p.kill()
 
-        # NOTE Get data before Manager is closed
-        shutdown_event = global_context.get('shutdownEvent')
-        signal_name    = global_context.get('signalName')
+        if on_process_exit:
+            for p in pool:
+                try:
+                    p.join(3)
+                    on_process_exit(context, p.pid)
+
+                except Exception as e:
+                    for line in traceback.format_exc().splitlines():
+                        LOGGER.error(line)
 
-        # Close Manager
-        manager.shutdown()
+        shutdown_event = context.shutdown_event
+        signal_name    = context.signal_name
 
         # Restart handling
         shutdown_event_handler_map = {
@@ -4,8 +4,14 @@
 import os
 import sys
 import socket
+import collections
 import ssl
 import urllib
+import traceback
+import threading
+import ctypes
+import random
+import concurrent.futures
 
 # 3rd-party Modules
 import timeout_decorator
@@ -23,7 +29,7 @@ from worker import app_init
 
 CONFIG = yaml_resources.get('CONFIG')
 
-from worker import LOGGER, CACHE_DB, LISTINGING_QUEUES, run_background
+from worker import LOGGER, CACHE_DB, LISTINGING_QUEUES, WORKER_ID, WorkerAutoScaler, run_background, prepare_fork_template
 from worker.tasks import TaskTimeout
 
 from worker.tasks.example          import ExampleSuccess, ExampleFailure, ExampleTimeout
@@ -59,16 +65,237 @@ TASK_CLS_MAP = {
     MigrationDataFix.name      : MigrationDataFix,
 }
 
+# Prefetched tasks in current process
+PREFETCHED_TASK_REQS = collections.deque()
+
+# Worker queue -> Queue
+WORKER_QUEUE_MAP = None
+
+# Priority / weight of queues for fetching
+QUEUE_PRIORITY_MAP = dict([ (int(q), float(v)) for q, v in (CONFIG['_WORKER_QUEUE_PRIORITY_MAP'] or {}).items() ])
+QUEUE_WEIGHT_MAP   = dict([ (int(q), float(v)) for q, v in (CONFIG['_WORKER_QUEUE_WEIGHT_MAP']   or {}).items() ])
+
+# Tasks in thread mode queues of current process
+TASK_THREAD_RUNNER = None
+
 class BadTaskReq(Exception):
     pass
 
+def get_prefetched_task_reqs_cache_key(pid=None):
+    return toolkit.get_cache_key('tempWorker', 'prefetchedTaskReqs', [ 'workerId', WORKER_ID, 'pid', pid or os.getpid() ])
+
+def get_queue(worker_queue):
+    global WORKER_QUEUE_MAP
+
+    if WORKER_QUEUE_MAP is None:
+        WORKER_QUEUE_MAP = dict([ (toolkit.get_worker_queue(q), q) for q in LISTINGING_QUEUES ])
+
+    return WORKER_QUEUE_MAP.get(worker_queue)
+
+def sort_queues(queues):
+    '''
+    Sort queues for one fetch, since Redis always serves the first non-empty queue
+    1. Queues with higher priority are always fetched first (`_WORKER_QUEUE_PRIORITY_MAP`, default 0)
+    2. Queues with the same priority are shuffled by weight (`_WORKER_QUEUE_WEIGHT_MAP`, default 1),
+       so that each non-empty queue is served first in proportion to its weight
+    '''
+    if not QUEUE_PRIORITY_MAP and not QUEUE_WEIGHT_MAP:
+        return queues
+
+    def sort_key(q):
+        priority = QUEUE_PRIORITY_MAP.get(q, 0)
+        weight   = QUEUE_WEIGHT_MAP.get(q, 1)
+
+        # Weighted random ordering (Efraimidis-Spirakis)
+        rand_key = random.random() ** (1.0 / weight) if weight > 0 else 0
+        return (-priority, -rand_key)
+
+    return sorted(queues, key=sort_key)
+
+def fetch_task_req(context, queues=None):
+    '''
+    Fetch task from prefetched tasks or the queue
+    1. Use prefetched task first
+    2. Block pop one task, then pop up to `_WORKER_PREFETCH_COUNT - 1` tasks in one round trip
+    3. Prefetched tasks are recorded in cache once per batch, and taken ones are counted in shared memory,
+       so that the main process can return the rest to the queue on shutdown
+    '''
+    global PREFETCHED_TASK_REQS
+
+    if PREFETCHED_TASK_REQS:
+        cache_res = PREFETCHED_TASK_REQS.popleft()
+        context.process_counter.value += 1
+
+        if not PREFETCHED_TASK_REQS:
+            CACHE_DB.delete(get_prefetched_task_reqs_cache_key())
+
+        return cache_res
+
+    cache_keys = list(map(lambda q: toolkit.get_worker_queue(q), queues or LISTINGING_QUEUES))
+    cache_res = CACHE_DB.bpop(cache_keys, timeout=CONFIG['_WORKER_FETCH_TASK_TIMEOUT'])
+    if not cache_res:
+        return None
+
+    prefetch_count = CONFIG['_WORKER_PREFETCH_COUNT'] - 1
+    if prefetch_count > 0:
+        prefetched = CACHE_DB.rpop_multi(cache_keys, prefetch_count)
+        if prefetched:
+            PREFETCHED_TASK_REQS.extend(prefetched)
+
+            # NOTE Reset counter before recording, the previous record has been removed
+            context.process_counter.value = 0
+
+            cache_key = get_prefetched_task_reqs_cache_key()
+            CACHE_DB.set(cache_key, toolkit.json_dumps(prefetched), expires=CONFIG['_TASK_EXPIRES_DEFAULT'])
+
+    return cache_res
+
+def return_prefetched_task_reqs(context, pid):
+    '''
+    Return prefetched tasks of the exited process to the queue
+    '''
+    cache_key = get_prefetched_task_reqs_cache_key(pid)
+    prefetched = CACHE_DB.get(cache_key)
+    if not prefetched:
+        return
+
+    CACHE_DB.delete(cache_key)
+
+    # Skip tasks already taken by the process
+    prefetched = toolkit.json_loads(prefetched)
+    prefetched = prefetched[context.get_process_counter(pid):]
+    if not prefetched:
+        return
+
+    # Queues are consumed by RPOP, so put back in reverse order to keep the original order
+    for worker_queue, task_req_dumps in reversed(prefetched):
+        CACHE_DB.rpush(worker_queue, task_req_dumps)
+
+    LOGGER.warning(f'Returned {len(prefetched)} prefetched Task(s) of Process {pid} to the queue')
+
+class TaskThreadRunner(object):
+    '''
+    Run Func tasks of thread mode queues in threads of the Worker process
+    1. Each queue runs up to N Tasks concurrently (`_WORKER_THREAD_CONCURRENCY_MAP`)
+    2. Queues without free threads are not fetched until a Task finished
+    3. Timeout is enforced per thread by raising `TaskTimeout` in the Task thread
+    '''
+    def __init__(self, concurrency_map):
+        self.concurrency_map   = concurrency_map
+        self.running_count_map = dict([ (q, 0) for q in concurrency_map.keys() ])
+
+        self.cond = threading.Condition()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=sum(concurrency_map.values()),
+                                                          thread_name_prefix='TaskThread')
+
+    def is_thread_queue(self, queue):
+        return queue in self.concurrency_map
+
+    def _get_fetchable_queues(self, queues):
+        return [ q for q in queues if not self.is_thread_queue(q) or self.running_count_map[q] < self.concurrency_map[q] ]
+
+    def wait_fetchable_queues(self, queues, timeout=None):
+        '''
+        Get queues with free threads, wait for a Task to finish if there is none
+        NOTE Checking and waiting must be in the same lock, or the notification may be missed
+        '''
+        with self.cond:
+            return self.cond.wait_for(lambda: self._get_fetchable_queues(queues), timeout)
+
+    def submit(self, queue, task_inst):
+        with self.cond:
+            # NOTE Prefetched Task may arrive when the queue has no free thread
+            while self.running_count_map[queue] >= self.concurrency_map[queue]:
+                self.cond.wait()
+
+            self.running_count_map[queue] += 1
+
+        self.pool.submit(self._run, queue, task_inst)
+
+    def _run(self, queue, task_inst):
+        thread_id = threading.get_ident()
+
+        timeout_lock = threading.Lock()
+        state = { 'finished': False }
+
+        def on_timeout():
+            with timeout_lock:
+                if state['finished']:
+                    return
+
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(TaskTimeout))
+
+        timer = threading.Timer(task_inst.timeout, on_timeout)
+        timer.daemon = True
+        timer.start()
+
+        try:
+            try:
+                task_inst.start()
+
+            finally:
+                with timeout_lock:
+                    state['finished'] = True
+
+        except TaskTimeout as e:
+            # Timeout reached right after Task finished
+            pass
+
+        except Exception as e:
+            for line in traceback.format_exc().splitlines():
+                LOGGER.error(line)
+
+        finally:
+            timer.cancel()
+
+            with self.cond:
+                self.running_count_map[queue] -= 1
+                self.cond.notify_all()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+def get_task_thread_runner():
+    '''
+    Get Task thread runner of current process, None if no listening queue is in thread mode
+    '''
+    global TASK_THREAD_RUNNER
+
+    if TASK_THREAD_RUNNER is None:
+        concurrency_map = {}
+        for q, concurrency in (CONFIG['_WORKER_THREAD_CONCURRENCY_MAP'] or {}).items():
+            q           = int(q)
+            concurrency = int(concurrency)
+            if q in LISTINGING_QUEUES and concurrency > 0:
+                concurrency_map[q] = concurrency
+
+        TASK_THREAD_RUNNER = TaskThreadRunner(concurrency_map) if concurrency_map else False
+
+    return TASK_THREAD_RUNNER or None
+
+def wait_task_threads(context):
+    '''
+    Wait for running Tasks in threads before the Worker process exits
+    '''
+    task_thread_runner = get_task_thread_runner()
+    if task_thread_runner:
+        task_thread_runner.shutdown()
+
 def consume(context):
     '''
     Consume tasks in the queue
     '''
+    task_thread_runner = get_task_thread_runner()
+
+    # Skip thread mode queues without free threads
+    queues = LISTINGING_QUEUES
+    if task_thread_runner:
+        queues = task_thread_runner.wait_fetchable_queues(LISTINGING_QUEUES, timeout=CONFIG['_WORKER_FETCH_TASK_TIMEOUT'])
+        if not queues:
+            return
+
     # Get the task
-    cache_keys = list(map(lambda q: toolkit.get_worker_queue(q), LISTINGING_QUEUES))
-    cache_res = CACHE_DB.bpop(cache_keys, timeout=CONFIG['_WORKER_FETCH_TASK_TIMEOUT'])
+    cache_res = fetch_task_req(context, sort_queues(queues))
     if not cache_res:
         return
 
@@ -88,6 +315,17 @@ def consume(context):
 
     task_inst = task_cls.from_task_request(task_req)
 
+    # Record wait time in the queue
+    queue = get_queue(worker_queue)
+    if queue is not None:
+        wait_ms = CACHE_DB.get_timestamp_ms() - (task_inst.eta or task_inst.trigger_time) * 1000
+        context.queue_fetch_stats.record(queue, wait_ms)
+
+    # Run Func task in thread
+    if task_thread_runner and task_cls is FuncRunner and task_thread_runner.is_thread_queue(queue):
+        task_thread_runner.submit(queue, task_inst)
+        return
+
     # Run task
     @timeout_decorator.timeout(task_inst.timeout, timeout_exception=TaskTimeout)
     def start_task():
@@ -107,9 +345,20 @@ def main():
     # App init
     app_init.prepare()
 
+    # Warm up before forking Worker processes
+    prepare_fork_template()
+
+    # Adjust the number of Worker processes automatically
+    autoscaler = None
+    if CONFIG['_WORKER_AUTOSCALE_ENABLED']:
+        autoscaler = WorkerAutoScaler(min_size=CONFIG['_WORKER_AUTOSCALE_MIN'], max_size=CONFIG['_WORKER_AUTOSCALE_MAX'])
+
     # Run background
     run_background(func=consume,
                    pool_size=CONFIG['_WORKER_CONCURRENCY'],
-                   max_tasks=CONFIG['_WORKER_PROCESS_CONSUME_LIMIT'])
+                   max_tasks=CONFIG['_WORKER_PROCESS_CONSUME_LIMIT'],
+                   on_process_exit=return_prefetched_task_reqs,
+                   on_loop_exit=wait_task_threads,
+                   autoscaler=autoscaler)
 if __name__ == '__main__':
     main()
@@ -77,17 +77,35 @@ SYSTEM_TASKS_META = [
     },
 ]
 
-def is_master_beat():
-    CACHE_DB.lock(BEAT_MASTER_LOCK_KEY, BEAT_MASTER_LOCK_VALUE, CONFIG['_BEAT_LOCK_EXPIRE'])
+def release_delayed_tasks(t):
+    '''
+    Renew the Beat master lock and put delayed tasks (eta <= t) into the work queues in one round trip
+    Return False if lock acquired by other process
+    '''
+    queues = list(range(CONFIG['_WORKER_QUEUE_COUNT']))
+    while queues:
+        queue_pairs = [ (toolkit.get_delay_queue(q), toolkit.get_worker_queue(q)) for q in queues ]
+        released_counts = CACHE_DB.lock_release_delayed_tasks(BEAT_MASTER_LOCK_KEY, BEAT_MASTER_LOCK_VALUE, CONFIG['_BEAT_LOCK_EXPIRE'],
+                queue_pairs, t, CONFIG['_BEAT_RELEASE_DELAYED_TASK_BULK_COUNT'])
 
-    try:
-        CACHE_DB.extend_lock_time(BEAT_MASTER_LOCK_KEY, BEAT_MASTER_LOCK_VALUE, CONFIG['_BEAT_LOCK_EXPIRE'])
-    except Exception as e:
         # Lock acquired by other process
-        return False
-    else:
-        # Successful renewal of the lock
-        return True
+        if released_counts is None:
+            return False
+
+        # Only retry the delay queues which may have more tasks to release
+        next_queues = []
+        for queue, released_count in zip(queues, released_counts):
+            if not released_count:
+                continue
+
+            LOGGER.info(f'[DELAYED] Released {released_count} tasks (Queue #{queue})')
+
+            if released_count >= CONFIG['_BEAT_RELEASE_DELAYED_TASK_BULK_COUNT']:
+                next_queues.append(queue)
+
+        queues = next_queues
+
+    return True
 
 def create_system_tasks(t):
     tasks = []
@@ -120,15 +138,16 @@ def tick(context):
         time.sleep(next_timestamp - now)
 
     # Trigger time
-    prev_tick_time = context.get('prev_tick_time') or (next_timestamp - 1)
+    prev_tick_time = context.prev_tick_time.value or (next_timestamp - 1)
     for tick_time in range(prev_tick_time, next_timestamp):
         tick_time += 1
 
         # Record the prev tick time
-        context['prev_tick_time'] = tick_time
+        context.prev_tick_time.value = tick_time
 
         # Prevent multiple Beat instances being triggered repeatedly
-        if not is_master_beat():
+        # Put delayed task into the work queue
+        if not release_delayed_tasks(tick_time):
             continue
 
         # Run the system tasks
@@ -150,18 +169,6 @@ def tick(context):
                 worker_queue = toolkit.get_worker_queue(task_req['queue'])
                 CACHE_DB.push(worker_queue, task_req_dumps)
 
-        # Put delayed task into the work queue
-        for queue in range(CONFIG['_WORKER_QUEUE_COUNT']):
-            src_cache_key  = toolkit.get_delay_queue(queue)
-            dest_cache_key = toolkit.get_worker_queue(queue)
-
-            while True:
-                released_count = CACHE_DB.zpop_below_lpush_all(src_cache_key, dest_cache_key, tick_time)
-                if released_count:
-                    LOGGER.info(f'[DELAYED] Released {released_count} tasks (Queue #{queue})')
-                else:
-                    break
-
 def main():
     # Print tips
     pid = os.getpid()
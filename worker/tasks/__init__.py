@@ -301,10 +301,10 @@ class BaseTask(object):
         else:
             return '\n'.join(parts[1:])
 
-    def lock(self, max_age=None):
+    def lock(self, max_age=None, tags=None):
         max_age = int(max_age or 30)
 
-        lock_key   = toolkit.get_cache_key('lock', 'task', tags=[ 'task', self.name ])
+        lock_key   = toolkit.get_cache_key('lock', 'task', tags=[ 'task', self.name ] + (tags or []))
         lock_value = toolkit.gen_uuid()
 
         if not self.cache_db.lock(lock_key, lock_value, max_age):
@@ -652,16 +652,22 @@ class BaseTask(object):
             self.logger.debug(f'[END TIME] `{self.end_time}` ({toolkit.get_datetime_string_cn(self.start_time)})')
             self.logger.debug(f'[STATUS] `{self.status}`')
 
-            # Buff Task Record
-            self.buff_task_record()
+            # Task epilogue, bookkeeping writes are sent in one round trip
+            self.cache_db.begin_pipeline()
+            try:
+                # Buff Task Record
+                self.buff_task_record()
 
-            # Send Task result response
-            if not self.ignore_result:
-                task_resp = self.create_task_resp()
-                self.response(task_resp)
+                # Send Task result response
+                if not self.ignore_result:
+                    task_resp = self.create_task_resp()
+                    self.response(task_resp)
 
-            # Unlock
-            self.unlock()
+                # Unlock
+                self.unlock()
+
+            finally:
+                self.cache_db.execute_pipeline()
 
     def run(self, **kwargs):
         self.logger.info(f'[RUN] Task Name: `{self.name}`')
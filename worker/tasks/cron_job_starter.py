@@ -6,7 +6,10 @@ Trigger the Funcs according to the Cron Jobs
 '''
 
 # Built-in Modules
+import os
 import time
+import math
+import heapq
 
 # 3rd-party Modules
 
@@ -16,6 +19,135 @@ from worker.tasks import BaseTask
 
 CONFIG = yaml_resources.get('CONFIG')
 
+class CronJobScheduleIndex(object):
+    '''
+    In-memory schedule index of Cron Jobs
+    The next trigger time of each Cron Job is kept in a heap,
+    so only the Cron Jobs to be triggered are processed in each minute.
+    '''
+    def __init__(self):
+        self.pid = os.getpid()
+
+        self.fingerprint = None
+        self.load_time   = 0
+
+        self.cron_jobs          = {} # <Cron Job ID>: <Cron Job>
+        self.cron_exprs         = {} # <Cron Job ID>: <Cron expression in use>
+        self.next_times         = {} # <Cron Job ID>: <Next trigger time>
+        self.dynamic_cron_exprs = {} # <Cron Job ID>: { "value": <Cron expression>, "expireTime": <Timestamp> }
+
+        self.heap = [] # [ (<Next trigger time>, <seq>, <Cron Job ID>) ]
+
+    def __len__(self):
+        return len(self.cron_jobs)
+
+    def clear(self):
+        self.fingerprint = None
+        self.load_time   = 0
+
+        self.cron_jobs.clear()
+        self.cron_exprs.clear()
+        self.next_times.clear()
+        self.heap.clear()
+
+    def get_cron_expr(self, cron_job_id, t):
+        c = self.cron_jobs[cron_job_id]
+
+        dynamic_cron_expr = self.dynamic_cron_exprs.get(cron_job_id)
+        if dynamic_cron_expr:
+            if not dynamic_cron_expr.get('expireTime') or dynamic_cron_expr['expireTime'] >= t:
+                return dynamic_cron_expr['value']
+
+        func_extra_config = c.get('funcExtraConfigJSON') or {}
+        return func_extra_config.get('fixedCronExpr') or c.get('cronExpr')
+
+    def schedule(self, cron_job_id, t):
+        '''
+        Compute the next trigger time (>= t) of the Cron Job
+        '''
+        self.next_times.pop(cron_job_id, None)
+
+        cron_expr = self.get_cron_expr(cron_job_id, t)
+        self.cron_exprs[cron_job_id] = cron_expr
+
+        if not cron_expr or not toolkit.is_valid_cron_expr(cron_expr):
+            return
+
+        timezone = self.cron_jobs[cron_job_id].get('timezone') or CONFIG['TIMEZONE']
+        try:
+            next_time = toolkit.get_next_cron_time(cron_expr, t, timezone)
+        except Exception as e:
+            # Cron expression never matches
+            return
+
+        self.next_times[cron_job_id] = next_time
+        heapq.heappush(self.heap, (next_time, self.cron_jobs[cron_job_id]['seq'], cron_job_id))
+
+        # Drop outdated heap items
+        if len(self.heap) > len(self.next_times) * 2 + 1000:
+            self.heap = [ (next_time, self.cron_jobs[_id]['seq'], _id) for _id, next_time in self.next_times.items() ]
+            heapq.heapify(self.heap)
+
+    def put(self, c, t):
+        self.cron_jobs[c['id']] = c
+        self.schedule(c['id'], t)
+
+    def remove(self, cron_job_id):
+        self.cron_jobs.pop(cron_job_id, None)
+        self.cron_exprs.pop(cron_job_id, None)
+        self.next_times.pop(cron_job_id, None)
+
+    def update_dynamic_cron_exprs(self, dynamic_cron_exprs, t):
+        changed_cron_job_ids = set(self.dynamic_cron_exprs.keys()) | set(dynamic_cron_exprs.keys())
+
+        self.dynamic_cron_exprs = dynamic_cron_exprs
+
+        # Reschedule Cron Jobs whose cron expression changed
+        for cron_job_id in changed_cron_job_ids:
+            if cron_job_id not in self.cron_jobs:
+                continue
+
+            if self.get_cron_expr(cron_job_id, t) != self.cron_exprs.get(cron_job_id):
+                self.schedule(cron_job_id, t)
+
+    def pop(self, t):
+        '''
+        Pop the Cron Jobs to be triggered at t, and schedule their next trigger time
+        '''
+        cron_jobs = []
+        while self.heap and self.heap[0][0] <= t:
+            next_time, seq, cron_job_id = heapq.heappop(self.heap)
+
+            # Outdated heap item
+            if self.next_times.get(cron_job_id) != next_time:
+                continue
+
+            c = self.cron_jobs[cron_job_id]
+
+            # Expired Cron Job
+            if c.get('expireTime') and c['expireTime'] <= t:
+                self.remove(cron_job_id)
+                continue
+
+            if next_time < t:
+                # Missed trigger time (triggered by other processes), reschedule from now
+                self.schedule(cron_job_id, t)
+
+            else:
+                cron_jobs.append(dict(c))
+                self.schedule(cron_job_id, t + 1)
+
+        return cron_jobs
+
+CRON_JOB_SCHEDULE_INDEX_MAP = {} # <Shard>: <CronJobScheduleIndex>
+
+def get_cron_job_schedule_index(shard):
+    index = CRON_JOB_SCHEDULE_INDEX_MAP.get(shard)
+    if index is None or index.pid != os.getpid():
+        index = CRON_JOB_SCHEDULE_INDEX_MAP[shard] = CronJobScheduleIndex()
+
+    return index
+
 class CronJobStarter(BaseTask):
     name = 'CronJob.Starter'
 
@@ -24,6 +156,14 @@ class CronJobStarter(BaseTask):
 
         self._worker_queue_availability = {}
 
+        # Cron Jobs are processed in shards (seq % shard count == shard index)
+        self.shard_index = 0
+        self.shard_count = 1
+
+    @property
+    def shard(self):
+        return f'{self.shard_index}/{self.shard_count}'
+
     @property
     def is_paused(self):
         cache_key = toolkit.get_global_cache_key('tempFlag', 'pauseCronJobs')
@@ -173,7 +313,7 @@ class CronJobStarter(BaseTask):
 
         return cron_jobs
 
-    def fetch_cron_jobs(self, next_seq):
+    def create_cron_job_sql(self):
         sql = self.db.create_sql_builder()
         sql.SELECT([
             'cron.seq',
@@ -181,6 +321,8 @@ class CronJobStarter(BaseTask):
             'cron.funcCallKwargsJSON',
             'cron.cronExpr',
             'cron.taskRecordLimit',
+            'cron.expireTime',
+            'cron.isDisabled',
 
             sql.FIELD('func.id',              'funcId'),
             sql.FIELD('func.extraConfigJSON', 'funcExtraConfigJSON'),
@@ -199,6 +341,18 @@ class CronJobStarter(BaseTask):
         sql.JOIN('biz_main_script_set', 'sset', {
             'sset.id': 'func.scriptSetId',
         })
+
+        if self.shard_count > 1:
+            sql.WHERE({
+                'LEFT' : sql.FUNC('MOD', [ sql.FIELD('cron.seq'), self.shard_count ]),
+                'OP'   : '=',
+                'RIGHT': self.shard_index,
+            })
+
+        return sql
+
+    def fetch_cron_jobs(self, next_seq, prepare=True):
+        sql = self.create_cron_job_sql()
         sql.WHERE([
             { 'LEFT': 'cron.seq',        'OP': '>', 'RIGHT': next_seq },
             { 'LEFT': 'cron.isDisabled', 'OP': '=', 'RIGHT': False },
@@ -220,11 +374,123 @@ class CronJobStarter(BaseTask):
             latest_seq = cron_jobs[-1]['seq']
 
             # Prepare / filter Cron Jobs
-            cron_jobs = self.prepare_cron_jobs(cron_jobs)
-            cron_jobs = filter(self.filter_cron_job, cron_jobs)
+            if prepare:
+                cron_jobs = self.prepare_cron_jobs(cron_jobs)
+                cron_jobs = filter(self.filter_cron_job, cron_jobs)
 
         return cron_jobs, latest_seq
 
+    def get_cron_job_fingerprint(self):
+        fingerprint = {}
+        for table in ( 'biz_main_cron_job', 'biz_main_func', 'biz_main_script', 'biz_main_script_set' ):
+            sql = self.db.create_sql_builder()
+            sql.SELECT([
+                sql.FUNC('COUNT', sql.FIELD('*'),          'count'),
+                sql.FUNC('MAX',   sql.FIELD('seq'),        'maxSeq'),
+                sql.FUNC('MAX',   sql.FIELD('updateTime'), 'maxUpdateTime'),
+            ])
+            sql.FROM(table)
+
+            db_res = self.db.query(sql)
+            fingerprint[table] = {
+                'count'        : int(db_res[0]['count'] or 0),
+                'maxSeq'       : int(db_res[0]['maxSeq'] or 0),
+                'maxUpdateTime': int(db_res[0]['maxUpdateTime'] or 0),
+            }
+
+        return fingerprint
+
+    def refresh_cron_job_schedule_index(self, index):
+        '''
+        Refresh the schedule index of Cron Jobs
+        1. Reload all Cron Jobs when Cron Jobs are added / removed, or Funcs / Scripts / Script Sets changed
+        2. Reload updated Cron Jobs only when Cron Jobs are modified
+        3. Reschedule Cron Jobs whose dynamic cron expression changed
+        '''
+        trigger_time = int(self.trigger_time)
+
+        fingerprint      = self.get_cron_job_fingerprint()
+        prev_fingerprint = index.fingerprint
+
+        is_full_reload = False
+        if not prev_fingerprint:
+            is_full_reload = True
+
+        elif time.time() - index.load_time > CONFIG['_CRON_JOB_STARTER_SCHEDULE_INDEX_RELOAD_INTERVAL']:
+            is_full_reload = True
+
+        else:
+            for table, table_fingerprint in fingerprint.items():
+                prev_table_fingerprint = prev_fingerprint[table]
+                if table == 'biz_main_cron_job':
+                    if table_fingerprint['count']  != prev_table_fingerprint['count'] \
+                        or table_fingerprint['maxSeq'] != prev_table_fingerprint['maxSeq']:
+                        is_full_reload = True
+                        break
+
+                elif table_fingerprint != prev_table_fingerprint:
+                    is_full_reload = True
+                    break
+
+        if is_full_reload:
+            # Reload all Cron Jobs
+            index.clear()
+
+            next_seq = 0
+            while next_seq is not None:
+                cron_jobs, next_seq = self.fetch_cron_jobs(next_seq, prepare=False)
+                for c in cron_jobs:
+                    index.put(c, trigger_time)
+
+            index.load_time = time.time()
+
+            self.logger.debug(f"[SCHEDULE INDEX] Reloaded {len(index)} Cron Jobs")
+
+        else:
+            # Reload modified Cron Jobs
+            max_update_time      = fingerprint['biz_main_cron_job']['maxUpdateTime']
+            prev_max_update_time = prev_fingerprint['biz_main_cron_job']['maxUpdateTime']
+            if max_update_time != prev_max_update_time:
+                sql = self.create_cron_job_sql()
+                sql.WHERE([
+                    { 'LEFT': 'cron.updateTime', 'OP': '>=', 'RIGHT': prev_max_update_time },
+                ])
+
+                cron_jobs = self.db.query(sql)
+                for c in cron_jobs:
+                    if c.get('isDisabled') or (c.get('expireTime') and c['expireTime'] <= trigger_time):
+                        index.remove(c['id'])
+                    else:
+                        index.put(c, trigger_time)
+
+                self.logger.debug(f"[SCHEDULE INDEX] Updated {len(cron_jobs)} Cron Jobs")
+
+        index.fingerprint = fingerprint
+
+        # Dynamic cron expression
+        cache_key = toolkit.get_global_cache_key('cronJob', 'dynamicCronExpr')
+        cache_res = self.cache_db.hgetall(cache_key) or {}
+
+        dynamic_cron_exprs = {}
+        for cron_job_id, dynamic_cron_expr in cache_res.items():
+            dynamic_cron_exprs[cron_job_id] = toolkit.json_loads(dynamic_cron_expr)
+
+        index.update_dynamic_cron_exprs(dynamic_cron_exprs, trigger_time)
+
+    def fetch_cron_jobs_by_schedule_index(self):
+        index = get_cron_job_schedule_index(self.shard)
+        self.refresh_cron_job_schedule_index(index)
+
+        cron_jobs = index.pop(int(self.trigger_time))
+        if not cron_jobs:
+            return []
+
+        # Prepare / filter Cron Jobs
+        cron_jobs = self.prepare_cron_jobs(cron_jobs)
+        cron_jobs = filter(self.filter_cron_job, cron_jobs)
+
+        return cron_jobs
+
     def put_tasks(self, tasks, ignore_cron_job_delay=False):
         tasks = toolkit.as_array(tasks)
         if not tasks:
@@ -298,38 +564,75 @@ class CronJobStarter(BaseTask):
         if task_reqs:
             self.cache_db.put_tasks(task_reqs)
 
-    def run(self, **kwargs):
-        # All Cron Jobs are paused
-        if self.is_paused:
-            self.logger.debug(f"[FLAG] Cron Jobs paused.")
-            return
+    def get_load_aware_delay_map(self, cron_jobs):
+        '''
+        Spread the Tasks of the minute according to Worker capacity and queue length
+        1. Worker capacity (Tasks per second) = Worker process count on queue / estimated Task cost
+        2. Spread range = (Tasks in queue + Tasks to put) / Worker capacity, up to `_FUNC_TASK_DISTRIBUTION_LOAD_SPREAD_MAX`
+        3. Tasks are delayed evenly in the spread range, and never delayed beyond their expires
+        '''
+        # Group Cron Jobs by Worker Queue
+        queue_cron_jobs_map = {}
+        for c in cron_jobs:
+            queue = str(c['funcExtraConfig'].get('queue') or CONFIG['_FUNC_TASK_QUEUE_CRON_JOB'])
+            if queue not in queue_cron_jobs_map:
+                queue_cron_jobs_map[queue] = []
 
-        # Lock
-        self.lock(max_age=60)
+            queue_cron_jobs_map[queue].append(c)
 
-        ### Integrated Cron Job ###
-        tasks = []
-        for c in self.get_integration_cron_job():
-            tasks.append({
-                'cronJob' : c,
-                'origin'  : 'integration',
-                'originId': c['id']
-            })
+        # Worker process count on each Worker Queue (reported by heartbeat)
+        cache_key = toolkit.get_monitor_cache_key('heartbeat', 'processCountOnQueue')
+        process_count_map = self.cache_db.hgetall_expires(cache_key, CONFIG['_MONITOR_REPORT_EXPIRES']) or {}
 
-        # Send Task
-        if tasks:
-            self.put_tasks(tasks)
+        delay_map = {}
+        for queue, queue_cron_jobs in queue_cron_jobs_map.items():
+            # Worker capacity
+            process_count = 0
+            if process_count_map.get(queue):
+                process_count = process_count_map[queue].get('processCount') or 0
 
-        ### Cron Jobs ###
-        next_seq = 0
-        while next_seq is not None:
-            cron_jobs, next_seq = self.fetch_cron_jobs(next_seq)
+            capacity = max(process_count, 1) / max(CONFIG['_FUNC_TASK_DISTRIBUTION_LOAD_TASK_COST'], 0.001)
+
+            # Worker capacity is shared by all shards
+            capacity = capacity / self.shard_count
+
+            # Tasks in Worker Queue / in Delay Queue to be run in spread range
+            worker_queue = toolkit.get_worker_queue(queue)
+            delay_queue  = toolkit.get_delay_queue(queue)
+
+            queue_length = int(self.cache_db.llen(worker_queue) or 0)
+            queue_length += int(self.cache_db.zcount(delay_queue, '-inf', self.trigger_time + CONFIG['_FUNC_TASK_DISTRIBUTION_LOAD_SPREAD_MAX']) or 0)
+
+            spread = min((queue_length + len(queue_cron_jobs)) / capacity, CONFIG['_FUNC_TASK_DISTRIBUTION_LOAD_SPREAD_MAX'])
+            if spread < 1:
+                continue
+
+            self.logger.debug(f"[DISTRIBUTION] Queue #{queue}: {len(queue_cron_jobs)} Tasks spread in {spread:.1f}s (Process Count: {process_count}, Queue Length: {queue_length})")
+
+            queue_cron_jobs.sort(key=lambda c: c['seq'])
+            for i, c in enumerate(queue_cron_jobs):
+                expires = c['funcExtraConfig'].get('expires') or CONFIG['_FUNC_TASK_EXPIRES_DEFAULT']
+                delay_map[c['id']] = min(int(i * spread / len(queue_cron_jobs)), max(expires - 1, 0))
+
+        return delay_map
+
+    def put_cron_job_tasks(self, cron_jobs):
+        cron_jobs = list(cron_jobs)
 
+        delay_map = None
+        if CONFIG['_FUNC_TASK_DISTRIBUTION_MODE'] == 'load':
+            delay_map = self.get_load_aware_delay_map(cron_jobs)
+
+        for g in toolkit.group_by_count(cron_jobs, count=CONFIG['_CRON_JOB_STARTER_FETCH_BULK_COUNT']):
             tasks = []
-            for c in cron_jobs:
-                # Distribute Tasks according to their seq
+            for c in g:
                 delay = 0
-                if CONFIG['_FUNC_TASK_DISTRIBUTION_RANGE'] > 0:
+                if delay_map is not None:
+                    # Distribute Tasks according to Worker load
+                    delay = delay_map.get(c['id']) or 0
+
+                elif CONFIG['_FUNC_TASK_DISTRIBUTION_RANGE'] > 0:
+                    # Distribute Tasks according to their seq
                     delay = c['seq'] % CONFIG['_FUNC_TASK_DISTRIBUTION_RANGE']
 
                 tasks.append({
@@ -343,6 +646,120 @@ class CronJobStarter(BaseTask):
             if tasks:
                 self.put_tasks(tasks)
 
+    def get_shard_count(self):
+        if CONFIG['_CRON_JOB_STARTER_SHARD_SIZE'] <= 0:
+            return 1
+
+        sql = self.db.create_sql_builder()
+        sql.SELECT([
+            sql.FUNC('COUNT', sql.FIELD('*'), 'count'),
+        ])
+        sql.FROM('biz_main_cron_job')
+        sql.WHERE({
+            'isDisabled': False,
+        })
+
+        db_res = self.db.query(sql)
+        cron_job_count = int(db_res[0]['count'] or 0)
+
+        shard_count = math.ceil(cron_job_count / CONFIG['_CRON_JOB_STARTER_SHARD_SIZE'])
+        shard_count = min(max(shard_count, 1), max(CONFIG['_CRON_JOB_STARTER_SHARD_MAX'], 1))
+        return shard_count
+
+    def put_shard_tasks(self, shard_count):
+        task_reqs = []
+        for shard_index in range(shard_count):
+            task_reqs.append({
+                'name': self.name,
+                'kwargs': {
+                    'shardIndex': shard_index,
+                    'shardCount': shard_count,
+                },
+
+                'triggerTime': self.trigger_time,
+
+                'queue'  : self.queue,
+                'expires': 60,
+            })
+
+        self.cache_db.put_tasks(task_reqs)
+
+    def record_shard_timing(self, cron_job_count):
+        now = self.cache_db.get_timestamp(3)
+
+        shard_timing = {
+            'ts'          : int(now),
+            'triggerTime' : self.trigger_time,
+            'waitCost'    : round(self.start_time - self.trigger_time, 3),
+            'runCost'     : round(now - self.start_time, 3),
+            'totalCost'   : round(now - self.trigger_time, 3),
+            'cronJobCount': cron_job_count,
+        }
+
+        # NOTE Fixed number of members, can be filtered when getting, no need to clean up expired data
+        cache_key = toolkit.get_monitor_cache_key('monitor', 'cronJobStarterShard')
+        self.cache_db.hset(cache_key, self.shard, toolkit.json_dumps(shard_timing))
+
+        if shard_timing['totalCost'] >= 60:
+            self.logger.warning(f"[SHARD] Cron Job Starter Shard {self.shard} overran: {shard_timing['totalCost']}s after trigger time")
+
+    def run(self, **kwargs):
+        # All Cron Jobs are paused
+        if self.is_paused:
+            self.logger.debug(f"[FLAG] Cron Jobs paused.")
+            return
+
+        if kwargs.get('shardCount'):
+            ### Shard Task ###
+            self.shard_index = int(kwargs.get('shardIndex') or 0)
+            self.shard_count = int(kwargs['shardCount'])
+
+            # Lock
+            self.lock(max_age=60, tags=[ 'shard', self.shard ])
+
+        else:
+            # Lock
+            self.lock(max_age=60)
+
+            ### Integrated Cron Job ###
+            tasks = []
+            for c in self.get_integration_cron_job():
+                tasks.append({
+                    'cronJob' : c,
+                    'origin'  : 'integration',
+                    'originId': c['id']
+                })
+
+            # Send Task
+            if tasks:
+                self.put_tasks(tasks)
+
+            # Split Cron Jobs into shards for a large number of Cron Jobs
+            shard_count = self.get_shard_count()
+            if shard_count > 1:
+                self.put_shard_tasks(shard_count)
+                return
+
+        ### Cron Jobs ###
+        cron_jobs = []
+        if CONFIG['_CRON_JOB_STARTER_SCHEDULE_INDEX_ENABLED']:
+            # Get Cron Jobs to trigger from the schedule index
+            cron_jobs.extend(self.fetch_cron_jobs_by_schedule_index())
+
+        else:
+            # Scan all Cron Jobs
+            next_seq = 0
+            while next_seq is not None:
+                _cron_jobs, next_seq = self.fetch_cron_jobs(next_seq)
+                cron_jobs.extend(_cron_jobs)
+
+        # Send Task
+        if cron_jobs:
+            self.put_cron_job_tasks(cron_jobs)
+
+        # Record timing
+        self.record_shard_timing(len(cron_jobs))
+
 class CronJobManualStarter(CronJobStarter):
     name = 'CronJob.ManualStarter'
 
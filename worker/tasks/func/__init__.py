@@ -6,11 +6,14 @@ import sys
 import inspect
 import traceback
 import linecache
-from types import ModuleType
+from types import ModuleType, MethodType
 import time
+import threading
 import importlib
 import functools
+import collections
 import concurrent
+import asyncio
 import urllib.parse
 
 # 3rd-party Modules
@@ -21,6 +24,7 @@ import funcsigs
 # Project Modules
 from worker.tasks import BaseTask
 from worker.utils import yaml_resources, toolkit
+from worker.utils.log_helper import LogHelper
 from worker.utils.extra_helpers import format_sql
 from worker.utils.extra_helpers import GuanceHelper, DataKitHelper, DataWayHelper, SidecarHelper
 from worker.utils.extra_helpers import InfluxDBHelper, MySQLHelper, RedisHelper, MemcachedHelper, ClickHouseHelper
@@ -108,20 +112,40 @@ ENV_VARIABLE_AUTO_TYPE_CASTING_FUNC_MAP = {
     'commaArray': lambda x: x.split(','),
 }
 
-# Thread pool for Func
-FUNC_THREAD_POOL       = None
-FUNC_THREAD_POOL_SIZE  = None
-FUNC_THREAD_RESULT_MAP = {}
-
 # Local cache for Script
 SCRIPT_LOCAL_CACHE = toolkit.LocalCache(expires=30)
 USER_SCRIPT_ID_BLACK_LIST = [
     '__future__'
 ]
 
+# Local cache for warmed Script scope (Script executed once and reused in the same process)
+SCRIPT_SCOPE_LOCAL_CACHE = toolkit.LocalCache(expires=CONFIG['_FUNC_WARM_SCOPE_EXPIRES'])
+
 # Local cache for Env Variable
 ENV_VARIABLE_LOCAL_CACHE = toolkit.LocalCache(expires=30)
 
+# Local cache for Connector helper (LRU, closed after idle timeout)
+CONNECTOR_HELPER_LOCAL_CACHE      = collections.OrderedDict()
+CONNECTOR_HELPER_LOCAL_CACHE_LOCK = threading.Lock()
+
+# Event loop for `async def` Funcs (one per thread, reused by Tasks)
+FUNC_EVENT_LOOP_LOCAL = threading.local()
+
+# Thread pool for calling sync helpers from `async def` Funcs (shared in process)
+FUNC_ASYNC_POOL = {
+    'pid' : None,
+    'pool': None,
+}
+FUNC_ASYNC_POOL_LOCK = threading.Lock()
+
+# Listener for data changed events
+#   Local cached Scripts / Env Variables are evicted once changed,
+#   and MD5 in Redis is only rechecked every `_FUNC_DATA_MD5_CACHE_CHECK_INTERVAL` seconds as a safety net
+DATA_MD5_CACHE_LISTENER = {
+    'pid'      : None,
+    'readyTime': None,
+}
+
 # Extra Python import path
 extra_import_paths = [
     CONFIG.get('RESOURCE_ROOT_PATH'),
@@ -143,6 +167,204 @@ temp_file_folders = [
 for _dir in (extra_import_paths + temp_file_folders):
     os.makedirs(_dir, exist_ok=True)
 
+def get_data_md5_changed_topic():
+    return toolkit.get_cache_key('cache', 'dataMD5Cache', ['event', 'changed'])
+
+def publish_data_md5_changed(cache_db, data_type, data_ids=None):
+    '''
+    Notify all worker processes to evict local cached data
+    '''
+    message = {
+        'type': data_type,
+        'ids' : toolkit.as_array(data_ids) if data_ids else None,
+    }
+    cache_db.publish(get_data_md5_changed_topic(), toolkit.json_dumps(message))
+
+def get_data_local_cache(data_type):
+    return {
+        'script'     : SCRIPT_LOCAL_CACHE,
+        'envVariable': ENV_VARIABLE_LOCAL_CACHE,
+    }.get(data_type)
+
+def evict_data_local_cache(data_type, data_ids=None):
+    if data_type == 'connector':
+        evict_connector_helper_local_cache(data_ids)
+        return
+
+    local_cache = get_data_local_cache(data_type)
+    if local_cache is None:
+        return
+
+    if not data_ids:
+        local_cache.clear()
+    else:
+        for data_id in toolkit.as_array(data_ids):
+            del local_cache[data_id]
+
+def is_data_md5_checked(data):
+    '''
+    Check if the local cached data can be used without checking MD5 in Redis
+    1. Listener is subscribed before the data checked (No changed event missed)
+    2. Data was checked within `_FUNC_DATA_MD5_CACHE_CHECK_INTERVAL` seconds
+    '''
+    ready_time = DATA_MD5_CACHE_LISTENER['readyTime']
+    check_time = data.get('md5CheckTime')
+    if not ready_time or not check_time or check_time < ready_time:
+        return False
+
+    return time.time() - check_time < CONFIG['_FUNC_DATA_MD5_CACHE_CHECK_INTERVAL']
+
+def get_connector_config_md5(config_json):
+    '''
+    Compute MD5 of Connector config (Same as `Internal.ReloadDataMD5Cache`)
+    '''
+    if isinstance(config_json, (list, tuple, dict)):
+        config_json = toolkit.json_dumps(config_json)
+
+    return toolkit.get_md5([ config_json ])
+
+def get_connector_helper_cache_key(connector_id, helper_kwargs=None):
+    if CONFIG['_FUNC_CONNECTOR_HELPER_CACHE_SIZE'] <= 0:
+        return None
+
+    try:
+        helper_kwargs_md5 = toolkit.get_md5(helper_kwargs or {})
+    except Exception as e:
+        # Helper kwargs cannot be serialized, no cache
+        return None
+
+    return f'{connector_id}:{helper_kwargs_md5}'
+
+def evict_connector_helper_local_cache(connector_ids=None):
+    if connector_ids:
+        connector_ids = toolkit.as_array(connector_ids)
+
+    # Helpers are closed when dereferenced, keep them out of the lock
+    evicted_helpers = []
+    with CONNECTOR_HELPER_LOCAL_CACHE_LOCK:
+        for cache_key in list(CONNECTOR_HELPER_LOCAL_CACHE.keys()):
+            cached = CONNECTOR_HELPER_LOCAL_CACHE[cache_key]
+            if not connector_ids or cached['connectorId'] in connector_ids:
+                evicted_helpers.append(CONNECTOR_HELPER_LOCAL_CACHE.pop(cache_key))
+
+    evicted_helpers.clear()
+
+def clean_connector_helper_local_cache():
+    '''
+    Remove idle helpers and the least recently used helpers over the cache size
+    '''
+    now = time.time()
+
+    evicted_helpers = []
+    with CONNECTOR_HELPER_LOCAL_CACHE_LOCK:
+        for cache_key in list(CONNECTOR_HELPER_LOCAL_CACHE.keys()):
+            cached = CONNECTOR_HELPER_LOCAL_CACHE[cache_key]
+            if now - cached['lastUseTime'] > CONFIG['_FUNC_CONNECTOR_HELPER_CACHE_IDLE_TIMEOUT']:
+                evicted_helpers.append(CONNECTOR_HELPER_LOCAL_CACHE.pop(cache_key))
+
+        while len(CONNECTOR_HELPER_LOCAL_CACHE) > CONFIG['_FUNC_CONNECTOR_HELPER_CACHE_SIZE']:
+            evicted_helpers.append(CONNECTOR_HELPER_LOCAL_CACHE.popitem(last=False)[1])
+
+    evicted_helpers.clear()
+
+def _listen_data_md5_changed():
+    logger   = LogHelper()
+    cache_db = RedisHelper(logger=logger)
+
+    topic = get_data_md5_changed_topic()
+    while True:
+        pubsub = None
+        try:
+            pubsub = cache_db.client.pubsub()
+            pubsub.subscribe(topic)
+
+            while True:
+                message = pubsub.get_message(timeout=10)
+                if not message:
+                    continue
+
+                if message['type'] == 'subscribe':
+                    # Data checked after this time will receive all changed events
+                    DATA_MD5_CACHE_LISTENER['readyTime'] = time.time()
+
+                elif message['type'] == 'message':
+                    data = toolkit.json_loads(message['data'])
+                    evict_data_local_cache(data.get('type'), data.get('ids'))
+
+        except Exception as e:
+            DATA_MD5_CACHE_LISTENER['readyTime'] = None
+
+            for line in traceback.format_exc().splitlines():
+                logger.error(line)
+
+            time.sleep(3)
+
+        finally:
+            if pubsub:
+                try:
+                    pubsub.close()
+                except Exception as e:
+                    pass
+
+def start_data_md5_cache_listener():
+    '''
+    Start listener thread once in each worker process
+    '''
+    if not CONFIG['_FUNC_DATA_MD5_CACHE_LISTENER_ENABLED']:
+        return
+
+    pid = os.getpid()
+    if DATA_MD5_CACHE_LISTENER['pid'] == pid:
+        return
+
+    DATA_MD5_CACHE_LISTENER['pid']       = pid
+    DATA_MD5_CACHE_LISTENER['readyTime'] = None
+
+    t = threading.Thread(target=_listen_data_md5_changed, daemon=True)
+    t.start()
+
+def get_func_event_loop():
+    loop = getattr(FUNC_EVENT_LOOP_LOCAL, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        FUNC_EVENT_LOOP_LOCAL.loop = loop
+
+    return loop
+
+def run_func_coroutine(coro):
+    '''
+    Run coroutine returned by `async def` Func in the event loop of current thread
+    '''
+    loop = get_func_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+
+    finally:
+        # Cancel unfinished coroutines (e.g. Task timeout), avoid running them in the next Task
+        pending = [ t for t in asyncio.all_tasks(loop) if not t.done() ]
+        for t in pending:
+            t.cancel()
+
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+def get_func_async_pool():
+    '''
+    Create thread pool once in each worker process
+    '''
+    pid = os.getpid()
+    with FUNC_ASYNC_POOL_LOCK:
+        if FUNC_ASYNC_POOL['pid'] != pid:
+            FUNC_ASYNC_POOL['pid']  = pid
+            FUNC_ASYNC_POOL['pool'] = concurrent.futures.ThreadPoolExecutor(max_workers=CONFIG['_FUNC_TASK_ASYNC_POOL_SIZE'],
+                                                                            thread_name_prefix='FuncAsync')
+
+    return FUNC_ASYNC_POOL['pool']
+
+async def run_in_func_async_pool(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_func_async_pool(), functools.partial(fn, *args, **kwargs))
+
 class DataFluxFuncBaseException(Exception):
     pass
 
@@ -248,6 +470,45 @@ class FuncContextHelper(object):
     def clear(self):
         return self.__data.clear()
 
+class TaskConnectorHelperProxy(object):
+    '''
+    Per-Task view of a cached Connector helper
+    Cached helpers are shared by concurrent Tasks in thread mode,
+    so methods are bound to this proxy to make `self.logger` point to the current Task logger
+    without modifying the shared helper.
+    1. Only `logger` is kept in the proxy, other attributes are read from / written to the cached helper
+    2. `__class__` is of the cached helper, so `isinstance()` works as usual
+    '''
+    def __init__(self, helper, logger):
+        object.__setattr__(self, '_helper', helper)
+        object.__setattr__(self, 'logger',  logger)
+
+    @property
+    def __class__(self):
+        return self._helper.__class__
+
+    def __getattr__(self, name):
+        helper_attrs = vars(self._helper)
+        if name in helper_attrs:
+            return helper_attrs[name]
+
+        attr = inspect.getattr_static(type(self._helper), name, None)
+        if inspect.isfunction(attr):
+            return MethodType(attr, self)
+        elif isinstance(attr, property):
+            return attr.__get__(self)
+
+        return getattr(self._helper, name)
+
+    def __setattr__(self, name, value):
+        if name == 'logger':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._helper, name, value)
+
+    def __delattr__(self, name):
+        delattr(self._helper, name)
+
 class FuncConnectorHelper(object):
     def __init__(self, task):
         self._task = task
@@ -255,12 +516,52 @@ class FuncConnectorHelper(object):
     def __call__(self, *args, **kwargs):
         return self.get(*args, **kwargs)
 
+    def _get_cached_helper(self, connector_id, cache_key):
+        '''
+        Get cached helper
+        1. Check if the config MD5 in local cache and the one cached in Redis are matched
+        2. MD5 checking in Redis is skipped when the data changed listener is ready and the helper was checked recently
+        '''
+        with CONNECTOR_HELPER_LOCAL_CACHE_LOCK:
+            cached = CONNECTOR_HELPER_LOCAL_CACHE.get(cache_key)
+            if not cached:
+                return None
+
+            CONNECTOR_HELPER_LOCAL_CACHE.move_to_end(cache_key)
+
+        if not is_data_md5_checked(cached):
+            remote_md5_cache_key = toolkit.get_cache_key('cache', 'dataMD5Cache', ['dataType', 'connector'])
+            remote_md5 = self._task.cache_db.hget(remote_md5_cache_key, connector_id)
+            if remote_md5:
+                remote_md5 = six.ensure_str(remote_md5)
+
+            if cached['configMD5'] != remote_md5:
+                evict_connector_helper_local_cache(connector_id)
+                return None
+
+            cached['md5CheckTime'] = time.time()
+
+        cached['lastUseTime'] = time.time()
+
+        # Log to current Task
+        helper = TaskConnectorHelperProxy(cached['helper'], self._task.logger)
+
+        self._task.logger.debug(f"[LOAD connector] load `{connector_id}` from Cache")
+        return helper
+
     def get(self, connector_id, **helper_kwargs):
         # Same connector may get different configs (e.g. specified different database)
         helper_kwargs = toolkit.no_none_or_whitespace(helper_kwargs)
 
         global CONNECTOR_HELPER_CLASS_MAP
 
+        # Get helper from local cache
+        cache_key = get_connector_helper_cache_key(connector_id, helper_kwargs)
+        if cache_key:
+            helper = self._get_cached_helper(connector_id, cache_key)
+            if helper:
+                return helper
+
         # Get Connector from DB
         self._task.logger.debug(f"[LOAD connector] load `{connector_id}` from DB")
 
@@ -269,6 +570,8 @@ class FuncConnectorHelper(object):
             'id',
             'type',
             'configJSON',
+
+            sql.FIELD('configJSON', 'configRaw'),
         ])
         sql.FROM('biz_main_connector')
         sql.WHERE({
@@ -294,6 +597,27 @@ class FuncConnectorHelper(object):
         config = decipher_connector_config(connector['id'], connector['configJSON'])
 
         helper = helper_class(self._task.logger, config, pool_size=CONFIG['_FUNC_TASK_CONNECTOR_POOL_SIZE'], **helper_kwargs)
+
+        # Cache helper
+        if cache_key:
+            config_md5 = get_connector_config_md5(connector['configRaw'])
+
+            remote_md5_cache_key = toolkit.get_cache_key('cache', 'dataMD5Cache', ['dataType', 'connector'])
+            self._task.cache_db.hset(remote_md5_cache_key, connector_id, config_md5)
+
+            now = time.time()
+            with CONNECTOR_HELPER_LOCAL_CACHE_LOCK:
+                CONNECTOR_HELPER_LOCAL_CACHE[cache_key] = {
+                    'connectorId' : connector_id,
+                    'configMD5'   : config_md5,
+                    'helper'      : helper,
+                    'lastUseTime' : now,
+                    'md5CheckTime': now,
+                }
+                CONNECTOR_HELPER_LOCAL_CACHE.move_to_end(cache_key)
+
+            clean_connector_helper_local_cache()
+
         return helper
 
     def reload_config_md5(self, connector_id):
@@ -302,7 +626,8 @@ class FuncConnectorHelper(object):
         sql = self._task.db.create_sql_builder()
         sql.SELECT([
             'id',
-            'configJSON',
+
+            sql.FIELD('configJSON', 'configRaw'),
         ])
         sql.FROM('biz_main_connector')
         sql.WHERE({
@@ -311,13 +636,16 @@ class FuncConnectorHelper(object):
         sql.LIMIT(1)
 
         connector = self._task.db.query(sql)
-        if not connector:
-            return
+        if connector:
+            connector = connector[0]
 
-        connector = connector[0]
+            connector_config_md5 = get_connector_config_md5(connector['configRaw'])
+            self._task.cache_db.hset(cache_key, connector_id, connector_config_md5)
+
+        else:
+            self._task.cache_db.hdel(cache_key, connector_id)
 
-        connector_config_md5 = toolkit.get_md5(connector['configJSON'])
-        self._task.cache_db.hset(cache_key, connector_id, connector_config_md5)
+        publish_data_md5_changed(self._task.cache_db, 'connector', connector_id)
 
     def save(self, connector_id, connector_type, config, title=None, description=None):
         if connector_type not in CONNECTOR_HELPER_CLASS_MAP:
@@ -421,6 +749,7 @@ class FuncEnvVariableHelper(object):
         a. Matched: use local cache
         b. Not Matched: Read from DB and update MD5 in Redis
     2. Load only once in one Task
+    3. MD5 checking in Redis is skipped when the data changed listener is ready and the Env Variable was checked recently
     '''
     def __init__(self, task):
         self._task = task
@@ -453,9 +782,15 @@ class FuncEnvVariableHelper(object):
         env_variable = ENV_VARIABLE_LOCAL_CACHE[env_variable_id]
         if env_variable:
             # Check the MD5 cached in Redis
-            remote_md5 = self._task.cache_db.hget(remote_md5_cache_key, env_variable_id)
-            if remote_md5:
-                remote_md5 = six.ensure_str(remote_md5)
+            if is_data_md5_checked(env_variable):
+                remote_md5 = env_variable['valueMD5']
+
+            else:
+                remote_md5 = self._task.cache_db.hget(remote_md5_cache_key, env_variable_id)
+                if remote_md5:
+                    remote_md5 = six.ensure_str(remote_md5)
+
+                env_variable['md5CheckTime'] = time.time()
 
             # Refresh local cache time and return cached value if MD5 not changed
             if env_variable['valueMD5'] == remote_md5:
@@ -507,6 +842,7 @@ class FuncEnvVariableHelper(object):
 
         # Cache Env Variable MD5
         self._task.cache_db.hset(remote_md5_cache_key, env_variable_id, env_variable['valueMD5'])
+        env_variable['md5CheckTime'] = time.time()
         ENV_VARIABLE_LOCAL_CACHE[env_variable_id] = env_variable
 
         # Cache Env Variable
@@ -1153,6 +1489,54 @@ class FuncCacheHelper(object):
         pattern = self._get_scoped_key(pattern, scope)
         return self._task.cache_db.delete_pattern(pattern)
 
+class FuncAsyncHelperProxy(object):
+    '''
+    Wrap methods of a sync helper as coroutine functions
+    '''
+    def __init__(self, helper):
+        self._helper = helper
+
+    async def __call__(self, *args, **kwargs):
+        return await run_in_func_async_pool(self._helper, *args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self._helper, name)
+        if not callable(attr):
+            return attr
+
+        async def _f(*args, **kwargs):
+            return await run_in_func_async_pool(attr, *args, **kwargs)
+
+        return _f
+
+class FuncAsyncHelper(object):
+    '''
+    Async variants of DFF helpers for `async def` Funcs
+    Calls are run in a shared thread pool of the process and awaited in the event loop,
+    so a Func can fan out many concurrent requests without creating a thread for each.
+
+    e.g.
+        value = await DFF.AIO.CACHE.get('key')
+        db    = await DFF.AIO.CONN('mysql')
+        data  = await db.query('SELECT 1')
+    '''
+    def __init__(self, task, connector_helper, store_helper, cache_helper):
+        self._task = task
+        self._connector_helper = connector_helper
+
+        self.STORE = FuncAsyncHelperProxy(store_helper)
+        self.CACHE = FuncAsyncHelperProxy(cache_helper)
+
+    async def CONN(self, connector_id, **helper_kwargs):
+        helper = await run_in_func_async_pool(self._connector_helper.get, connector_id, **helper_kwargs)
+        return FuncAsyncHelperProxy(helper)
+
+    # [Compatibility] Data Source was changed to Connector
+    SRC = CONN
+
+    async def run(self, fn, *args, **kwargs):
+        return await run_in_func_async_pool(fn, *args, **kwargs)
+
 class FuncConfigHelper(object):
     MASKED_CONFIG = toolkit.json_mask(CONFIG)
 
@@ -1319,23 +1703,17 @@ class FuncThreadHelper(object):
 
     @property
     def is_all_finished(self):
-        global FUNC_THREAD_RESULT_MAP
-
-        if not FUNC_THREAD_RESULT_MAP:
+        if not self._task.func_thread_result_map:
             return True
 
-        return all([ future_res.done() for key, future_res in FUNC_THREAD_RESULT_MAP.items() ])
+        return all([ future_res.done() for key, future_res in self._task.func_thread_result_map.items() ])
 
     @property
     def pool_size(self):
-        global FUNC_THREAD_POOL_SIZE
-        return FUNC_THREAD_POOL_SIZE
+        return self._task.func_thread_pool_size
 
     def set_pool_size(self, pool_size):
-        global FUNC_THREAD_POOL
-        global FUNC_THREAD_POOL_SIZE
-
-        if FUNC_THREAD_POOL:
+        if self._task.func_thread_pool:
             _msg = f"[THREAD POOL] Cannot set thread pool size after task submitted, skip"
             self._task.logger.info(_msg)
             self._task._log(self._task.script_scope, _msg)
@@ -1351,60 +1729,52 @@ class FuncThreadHelper(object):
             e = Exception('Invalid pool size, should be an integer which is greater than 0')
             raise e
 
-        FUNC_THREAD_POOL_SIZE = pool_size
+        self._task.func_thread_pool_size = pool_size
 
     def create_pool(self):
-        global FUNC_THREAD_POOL
-        global FUNC_THREAD_POOL_SIZE
-
-        if FUNC_THREAD_POOL:
+        if self._task.func_thread_pool:
             _msg = f"[THREAD POOL] Thread pool is already created, skip"
             self._task.logger.info(_msg)
             self._task._log(self._task.script_scope, _msg)
             return
 
-        pool_size = FUNC_THREAD_POOL_SIZE or CONFIG['_FUNC_TASK_THREAD_POOL_SIZE_DEFAULT']
-        FUNC_THREAD_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size)
+        pool_size = self._task.func_thread_pool_size or CONFIG['_FUNC_TASK_THREAD_POOL_SIZE_DEFAULT']
+        self._task.func_thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size)
 
         _msg = f"[THREAD POOL] Pool created (size={pool_size})"
         self._task.logger.debug(_msg)
         self._task._log(self._task.script_scope, _msg)
 
     def submit(self, fn, *args, **kwargs):
-        global FUNC_THREAD_POOL
-        global FUNC_THREAD_RESULT_MAP
-
-        if not FUNC_THREAD_POOL:
+        if not self._task.func_thread_pool:
             self.create_pool()
 
         key = toolkit.gen_data_id('thread-result')
         self._task.logger.debug(f'[THREAD POOL] Submit Key=`{key}`')
 
-        if key in FUNC_THREAD_RESULT_MAP:
+        if key in self._task.func_thread_result_map:
             e = DuplicatedThreadResultKey(f'Thread result key already existed: `{key}`')
             raise e
 
         args   = args   or []
         kwargs = kwargs or {}
-        FUNC_THREAD_RESULT_MAP[key] = FUNC_THREAD_POOL.submit(fn, *args, **kwargs)
+        self._task.func_thread_result_map[key] = self._task.func_thread_pool.submit(fn, *args, **kwargs)
 
         return key
 
     def _get_result(self, key=None, wait=True):
-        global FUNC_THREAD_RESULT_MAP
-
-        if not FUNC_THREAD_RESULT_MAP:
+        if not self._task.func_thread_result_map:
             return None
 
         collected_res = {}
 
-        keys = key or list(FUNC_THREAD_RESULT_MAP.keys())
+        keys = key or list(self._task.func_thread_result_map.keys())
         for k in toolkit.as_array(keys):
             k = str(k)
 
             collected_res[k] = None
 
-            future_res = FUNC_THREAD_RESULT_MAP.get(k)
+            future_res = self._task.func_thread_result_map.get(k)
             if future_res is None:
                 continue
 
@@ -1432,22 +1802,20 @@ class FuncThreadHelper(object):
         return self._get_result(wait=wait).values()
 
     def pop_result(self, wait=True):
-        global FUNC_THREAD_RESULT_MAP
-
-        if not FUNC_THREAD_RESULT_MAP:
+        if not self._task.func_thread_result_map:
             return None
 
         finished_key = None
         while True:
             # Find the result that is done
-            for key, future_res in FUNC_THREAD_RESULT_MAP.items():
+            for key, future_res in self._task.func_thread_result_map.items():
                 if future_res.done():
                     finished_key = key
                     break
 
             # Not found, wait
             if not finished_key and wait:
-                for _ in concurrent.futures.wait(FUNC_THREAD_RESULT_MAP.values(), return_when=concurrent.futures.FIRST_COMPLETED):
+                for _ in concurrent.futures.wait(self._task.func_thread_result_map.values(), return_when=concurrent.futures.FIRST_COMPLETED):
                     break
                 continue
 
@@ -1456,7 +1824,7 @@ class FuncThreadHelper(object):
         if finished_key is None:
             return None
 
-        future_res = FUNC_THREAD_RESULT_MAP.pop(finished_key)
+        future_res = self._task.func_thread_result_map.pop(finished_key)
 
         value = None
         error = None
@@ -1899,6 +2267,8 @@ class FuncBaseTask(BaseTask):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        start_data_md5_cache_listener()
+
         self.__context_helper = FuncContextHelper(self)
 
         self.__loaded_script_cache   = toolkit.LocalCache()
@@ -1952,6 +2322,11 @@ class FuncBaseTask(BaseTask):
         # `print` log lines
         self.__print_log_lines = None
 
+        # Thread pool for `DFF.THREAD` (per Task, Tasks may run in threads of the same process)
+        self.func_thread_pool       = None
+        self.func_thread_pool_size  = None
+        self.func_thread_result_map = {}
+
         # Extra data for Guance, TrueWatch
         self.extra_guance_data = FuncExtraGuanceDataHelper(self)
 
@@ -2134,7 +2509,7 @@ class FuncBaseTask(BaseTask):
 
     def _export_as_api(self, safe_scope, title,
                     # Configs for controls
-                    fixed_cron_expr=None, delayed_cron_job=None, timeout=None, expires=None, cache_result=None, queue=None,
+                    fixed_cron_expr=None, delayed_cron_job=None, timeout=None, expires=None, cache_result=None, queue=None, warm_scope=None,
                     # Configs for marking
                     category=None, tags=None,
                     # Configs for integration
@@ -2258,6 +2633,15 @@ class FuncBaseTask(BaseTask):
 
             extra_config['queue'] = queue
 
+        # Reuse executed Script scope in the same process
+        if warm_scope is not None:
+            if not isinstance(warm_scope, bool):
+                e = InvalidAPIOption('`warm_scope` should be True or False')
+                raise e
+
+            if warm_scope is True:
+                extra_config['warmScope'] = True
+
         #######################
         # Configs for marking #
         #######################
@@ -2505,6 +2889,7 @@ class FuncBaseTask(BaseTask):
         2. For published Script, check if the MD5 in local cache (60s expires) and in Redis matches
             a. If matches, use local cached Script directly
             b. Otherwise, read Script from DB and update Redis cache
+        3. MD5 checking in Redis is skipped when the data changed listener is ready and the Script was checked recently
         '''
         # Only those with `__` in their name are likely to be user Scripts
         if '__' not in script_id:
@@ -2523,9 +2908,15 @@ class FuncBaseTask(BaseTask):
             script = SCRIPT_LOCAL_CACHE[script_id]
             if script:
                 # Check Script MD5 in Redis
-                remote_md5 = self.cache_db.hget(remote_md5_cache_key, script_id)
-                if remote_md5:
-                    remote_md5 = six.ensure_str(remote_md5)
+                if is_data_md5_checked(script):
+                    remote_md5 = script['codeMD5']
+
+                else:
+                    remote_md5 = self.cache_db.hget(remote_md5_cache_key, script_id)
+                    if remote_md5:
+                        remote_md5 = six.ensure_str(remote_md5)
+
+                    script['md5CheckTime'] = time.time()
 
                 # Refresh local cache and return if MD5 not changed
                 if script['codeMD5'] == remote_md5:
@@ -2608,6 +2999,7 @@ class FuncBaseTask(BaseTask):
         if not draft:
             # Cache Script MD5
             self.cache_db.hset(remote_md5_cache_key, script_id, script['codeMD5'])
+            script['md5CheckTime'] = time.time()
             SCRIPT_LOCAL_CACHE[script_id] = script
 
         # Cache Script
@@ -2663,6 +3055,7 @@ class FuncBaseTask(BaseTask):
         __sync_api_helper     = FuncSyncAPIHelper(self)
         __async_api_helper    = FuncAsyncAPIHelper(self)
         __cron_job_helper     = FuncCronJobHelper(self)
+        __async_helper        = FuncAsyncHelper(self, __connector_helper, __store_helper, __cache_helper)
 
         def __print(*args, **kwargs):
             return self._print(safe_scope, *args, **kwargs)
@@ -2719,6 +3112,7 @@ class FuncBaseTask(BaseTask):
             'FUNC'     : __call_func,      # Call Func (new Task)
             'BLUEPRINT': __call_blueprint, # Call Blueprint (new Task)
             'THREAD'   : __thread_helper,  # Thread helper (in same Task)
+            'AIO'      : __async_helper,   # Async helper (for `async def` Funcs)
 
             'TASK'        : self,          # Current Task
             'SYS_DB'      : self.raw_db,   # DataFlux Func system DB
@@ -2776,6 +3170,111 @@ class FuncBaseTask(BaseTask):
 
         return safe_scope
 
+    def is_warm_scope_enabled(self, use_code_draft=False):
+        '''
+        Check if the Script scope can be reused in the same process
+        1. Draft Script is always executed from scratch
+        2. Enabled by `@DFF.API(..., warm_scope=True)` for the Func
+        3. Enabled by `_FUNC_WARM_SCOPE_SCRIPT_LIST` for the whole Script
+        '''
+        if use_code_draft or not self.script:
+            return False
+
+        # Reused scope cannot be shared by Tasks running in threads at the same time
+        if threading.current_thread() is not threading.main_thread():
+            return False
+
+        func_extra_config = (self.script.get('funcExtraConfig') or {}).get(self.func_id) or {}
+        if func_extra_config.get('warmScope') is True:
+            return True
+
+        return toolkit.match_wildcards(self.script_id, CONFIG['_FUNC_WARM_SCOPE_SCRIPT_LIST'], simple_mode=True)
+
+    def refresh_safe_scope(self, safe_scope, script_name=None, parent_scope=None):
+        '''
+        Swap in `_DFF_*` variables, `DFF` object and builtins of the current Task to a reused scope
+        '''
+        new_scope = self.create_safe_scope(script_name, debug=safe_scope.get('_DFF_DEBUG') or False)
+
+        # Keep exported API Funcs
+        new_scope['DFF'].api_func_set = safe_scope['DFF'].api_func_set
+        new_scope['DFF'].api_funcs    = safe_scope['DFF'].api_funcs
+
+        if parent_scope:
+            new_scope['DFF'].print_log_lines = parent_scope['DFF'].print_log_lines
+
+            for k, v in parent_scope.items():
+                if k.startswith('_DFF_'):
+                    new_scope[k] = v
+
+        for k, v in new_scope.items():
+            if k == '__builtins__':
+                # Functions defined in Script hold the original builtins dict, so update it in place
+                safe_scope['__builtins__'].update(v)
+
+            elif k == 'DFF' or k.startswith('_DFF_'):
+                safe_scope[k] = v
+
+        return safe_scope
+
+    def load_warm_scope(self):
+        '''
+        Load reused Script scope
+        1. Scope is cached by Script ID and code MD5
+        2. Cache will be dropped if any imported Script changed
+        '''
+        global SCRIPT_SCOPE_LOCAL_CACHE
+
+        cache_key = f"{self.script_id}:{self.script['codeMD5']}"
+
+        warm_scope = SCRIPT_SCOPE_LOCAL_CACHE[cache_key]
+        if not warm_scope:
+            return None
+
+        # Check imported Scripts
+        for import_script_id, code_md5 in warm_scope['importedScriptMD5Map'].items():
+            import_script = self.load_script(import_script_id)
+            if not import_script or import_script['codeMD5'] != code_md5:
+                self.logger.debug(f'[WARM SCOPE] imported Script `{import_script_id}` changed, drop scope of `{self.script_id}`')
+
+                del SCRIPT_SCOPE_LOCAL_CACHE[cache_key]
+                return None
+
+        # Swap in current Task
+        script_scope = self.refresh_safe_scope(warm_scope['scope'], self.script_id)
+        for import_script_id, _module in warm_scope['importedModules'].items():
+            self.refresh_safe_scope(_module.__dict__, import_script_id, parent_scope=script_scope)
+
+            self.__imported_module_cache[import_script_id] = _module
+
+        SCRIPT_SCOPE_LOCAL_CACHE.refresh(cache_key)
+
+        self.logger.debug(f'[WARM SCOPE] reused scope of `{self.script_id}`')
+        return script_scope
+
+    def save_warm_scope(self, script_scope):
+        global SCRIPT_SCOPE_LOCAL_CACHE
+
+        cache_key = f"{self.script_id}:{self.script['codeMD5']}"
+
+        imported_script_md5_map = {}
+        imported_modules        = {}
+        for import_script_id in list(self.__imported_module_cache.keys()):
+            import_script = self.__loaded_script_cache[import_script_id]
+            if not import_script:
+                return
+
+            imported_script_md5_map[import_script_id] = import_script['codeMD5']
+            imported_modules[import_script_id]        = self.__imported_module_cache[import_script_id]
+
+        SCRIPT_SCOPE_LOCAL_CACHE[cache_key] = {
+            'scope'               : script_scope,
+            'importedScriptMD5Map': imported_script_md5_map,
+            'importedModules'     : imported_modules,
+        }
+
+        self.logger.debug(f'[WARM SCOPE] saved scope of `{self.script_id}`')
+
     def apply(self, use_code_draft=False):
         self.logger.debug(f"[APPLY SCRIPT] `{self.script_id}`{ ' (DRAFT)' if use_code_draft else '' }")
 
@@ -2786,9 +3285,17 @@ class FuncBaseTask(BaseTask):
             raise e
 
         # Run Script
-        debug = use_code_draft
-        _safe_scope = self.create_safe_scope(self.script_id, debug=debug)
-        self.script_scope = self.safe_exec(self.script['codeObj'], globals=_safe_scope)
+        is_warm_scope_enabled = self.is_warm_scope_enabled(use_code_draft)
+        if is_warm_scope_enabled:
+            self.script_scope = self.load_warm_scope()
+
+        if not self.script_scope:
+            debug = use_code_draft
+            _safe_scope = self.create_safe_scope(self.script_id, debug=debug)
+            self.script_scope = self.safe_exec(self.script['codeObj'], globals=_safe_scope)
+
+            if is_warm_scope_enabled:
+                self.save_warm_scope(self.script_scope)
 
         # Run Func in Script
         func_return = None
@@ -2802,6 +3309,10 @@ class FuncBaseTask(BaseTask):
             self.logger.info(f'[CALL ENTRY FUNC] `{self.func_id}`')
             func_return = entry_func(**self.func_call_kwargs)
 
+            # Run `async def` Func in event loop
+            if inspect.isawaitable(func_return):
+                func_return = run_func_coroutine(func_return)
+
             if not isinstance(func_return, BaseFuncResponse):
                 func_return = FuncResponse(func_return)
 
@@ -2887,17 +3398,16 @@ class FuncBaseTask(BaseTask):
             exc_type = exc_obj = tb = None
 
     def clean_up(self):
-        global FUNC_THREAD_POOL
-        global FUNC_THREAD_POOL_SIZE
-        global FUNC_THREAD_RESULT_MAP
-
-        if FUNC_THREAD_POOL:
-            FUNC_THREAD_POOL.shutdown(wait=True)
+        if self.func_thread_pool:
+            self.func_thread_pool.shutdown(wait=True)
             self.logger.debug(f"[THREAD POOL] Pool Shutdown")
 
-        FUNC_THREAD_POOL       = None
-        FUNC_THREAD_POOL_SIZE  = None
-        FUNC_THREAD_RESULT_MAP = {}
+        self.func_thread_pool       = None
+        self.func_thread_pool_size  = None
+        self.func_thread_result_map = {}
+
+        # Close idle Connector helpers
+        clean_connector_helper_local_cache()
 
     def buff_task_record(self, *args, **kwargs):
         # Task Record for Func implemented in sub class
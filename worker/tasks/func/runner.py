@@ -355,6 +355,9 @@ class FuncRunner(FuncBaseTask):
                 func_resp.cache_to_file(cache_result_expires or 0)
 
         except Exception as e:
+            # Start Task epilogue (sent in `BaseTask.start()`)
+            self.cache_db.begin_pipeline()
+
             # Cache Task status
             self.cache_last_task_status(status='failure', exception=e)
 
@@ -364,6 +367,9 @@ class FuncRunner(FuncBaseTask):
             raise
 
         else:
+            # Start Task epilogue (sent in `BaseTask.start()`)
+            self.cache_db.begin_pipeline()
+
             # Cache Task status
             self.cache_last_task_status(status='success')
 
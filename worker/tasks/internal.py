@@ -15,7 +15,6 @@ import zipfile
 
 # 3rd-party Modules
 import arrow
-from croniter import croniter
 from datasize import DataSize
 import parse_args
 
@@ -23,7 +22,7 @@ import parse_args
 from worker.utils import toolkit, yaml_resources
 from worker.utils.extra_helpers import HexStr
 from worker.tasks import BaseTask
-from worker.tasks.func import CONNECTOR_HELPER_CLASS_MAP, decipher_connector_config
+from worker.tasks.func import CONNECTOR_HELPER_CLASS_MAP, decipher_connector_config, publish_data_md5_changed
 from worker.utils.extra_helpers import FuncMySQLHelper, FuncPostgreSQLHelper
 
 CONFIG     = yaml_resources.get('CONFIG')
@@ -255,6 +254,7 @@ class SystemMetric(BaseInternalTask):
         sql.SELECT([
             'cron.id',
             'cron.cronExpr',
+            'cron.timezone',
             'func.extraConfigJSON',
         ])
         sql.FROM('biz_main_cron_job', 'cron')
@@ -306,27 +306,16 @@ class SystemMetric(BaseInternalTask):
             # Compute trigger time in next 24 hours
             c['extraConfigJSON'] = c.get('extraConfigJSON') or {}
             cron_expr = c.get('dynamicCronExpr') or c['extraConfigJSON'].get('fixedCronExpr') or c['cronExpr']
-            if not cron_expr:
+            if not cron_expr or not toolkit.is_valid_cron_expr(cron_expr):
                 continue
 
             # No repeat computing for the same expression
-            if cron_expr in trigger_count_map:
-                total_trigger_count += trigger_count_map[cron_expr]
-            else:
-                start_time = now
-                end_time   = start_time + 24 * 3600
-
-                cron = croniter(cron_expr, start_time=start_time)
-                curr_time = cron.next()
-
-                trigger_count = 0
-                while curr_time < end_time:
-                    curr_time = cron.next()
-                    trigger_count += 1
+            timezone = c.get('timezone') or CONFIG['TIMEZONE']
+            trigger_count_key = (cron_expr, timezone)
+            if trigger_count_key not in trigger_count_map:
+                trigger_count_map[trigger_count_key] = toolkit.count_cron_triggers(cron_expr, now, now + 24 * 3600, timezone)
 
-                total_trigger_count += trigger_count
-
-                trigger_count_map[cron_expr] = trigger_count
+            total_trigger_count += trigger_count_map[trigger_count_key]
 
         trigger_count_per_day    = float(total_trigger_count)
         trigger_count_per_hour   = float(round(total_trigger_count / 24, 1))
@@ -386,17 +375,134 @@ class FlushDataBuffer(BaseInternalTask):
     }
 
     def _flush_data_buffer(self, cache_key):
-        data = []
-        for i in range(CONFIG['_TASK_FLUSH_DATA_BUFFER_BULK_COUNT']):
-            cache_res = self.cache_db.pop(cache_key)
-            if not cache_res:
-                break
-
-            data.append(cache_res)
+        # Pop data in one round trip
+        # NOTE `RPOP key count` requires Redis 6.2+, use Lua script instead
+        popped = self.cache_db.rpop_multi(cache_key, CONFIG['_TASK_FLUSH_DATA_BUFFER_BULK_COUNT'])
 
-        data = list(map(lambda x: toolkit.json_loads(x), data))
+        data = list(map(lambda x: toolkit.json_loads(x[1]), popped))
         return data
 
+    def _bulk_insert(self, table, data):
+        '''
+        Write data by multi-row INSERT in one transaction
+        Each INSERT contains up to `_TASK_FLUSH_DATA_INSERT_BULK_COUNT` rows
+        and about `_TASK_FLUSH_DATA_INSERT_BULK_SIZE` bytes
+        '''
+        if not data:
+            return
+
+        # Split data into chunks
+        chunks = []
+
+        chunk      = []
+        chunk_size = 0
+        for d in data:
+            row_size = sum([ len(v) if isinstance(v, str) else 8 for v in d.values() ])
+
+            if chunk and (len(chunk) >= CONFIG['_TASK_FLUSH_DATA_INSERT_BULK_COUNT']
+                    or chunk_size + row_size > CONFIG['_TASK_FLUSH_DATA_INSERT_BULK_SIZE']):
+                chunks.append(chunk)
+
+                chunk      = []
+                chunk_size = 0
+
+            chunk.append(d)
+            chunk_size += row_size
+
+        if chunk:
+            chunks.append(chunk)
+
+        # Write in one transaction
+        trans_conn = self.db.start_trans()
+        try:
+            for chunk in chunks:
+                sql = self.db.create_sql_builder()
+                sql.INSERT_INTO(table)
+                sql.VALUES(chunk)
+
+                self.db.trans_query(trans_conn, sql)
+
+        except Exception as e:
+            self.db.rollback(trans_conn)
+            raise
+
+        else:
+            self.db.commit(trans_conn)
+
+    def _roll_task_record_func(self, origin_limit_map):
+        '''
+        Remove expired Func task records of each origin
+        1. Get expired max seq of origins with the same limit in one query
+        2. Delete expired data of multiple origins in one DELETE, and pause between DELETEs
+        NOTE Window functions are not used since MySQL 5.7 is still supported
+        '''
+        bulk_count = max(CONFIG['_TASK_RECORD_FUNC_ROLL_ORIGIN_BULK_COUNT'], 1)
+
+        # Group origins by limit
+        limit_origin_ids_map = {}
+        for origin_id, limit in origin_limit_map.items():
+            if limit not in limit_origin_ids_map:
+                limit_origin_ids_map[limit] = []
+
+            limit_origin_ids_map[limit].append(origin_id)
+
+        # Get expired max seq
+        expired_max_seqs = []
+        for limit, origin_ids in limit_origin_ids_map.items():
+            for i in range(0, len(origin_ids), bulk_count):
+                chunk_origin_ids = origin_ids[i:i + bulk_count]
+
+                sub_sql = self.db.create_sql_builder()
+                sub_sql.SELECT('t.seq')
+                sub_sql.FROM('biz_main_task_record_func', 't')
+                sub_sql.WHERE({
+                    'LEFT' : 't.originId',
+                    'OP'   : '=',
+                    'RIGHT': sub_sql.FIELD('o.originId'),
+                })
+                sub_sql.ORDER_BY('t.seq', 'DESC')
+                sub_sql.LIMIT(1, limit)
+
+                sql = self.db.create_sql_builder()
+                sql.SELECT([
+                    'o.originId',
+                    sql.RAW(f"({str(sub_sql).rstrip(';')})", 'expiredMaxSeq'),
+                ])
+                sql.FROM('biz_main_task_record_func', 'o')
+                sql.WHERE({
+                    'o.originId': chunk_origin_ids,
+                })
+                sql.GROUP_BY('o.originId')
+
+                db_res = self.db.query(sql)
+                for d in db_res:
+                    if d['expiredMaxSeq'] is None:
+                        continue
+
+                    expired_max_seqs.append(d)
+
+        # Delete expired data
+        for i in range(0, len(expired_max_seqs), bulk_count):
+            if i > 0 and CONFIG['_TASK_RECORD_FUNC_ROLL_DELETE_INTERVAL'] > 0:
+                time.sleep(CONFIG['_TASK_RECORD_FUNC_ROLL_DELETE_INTERVAL'])
+
+            sql = self.db.create_sql_builder()
+
+            expired_conditions = []
+            for d in expired_max_seqs[i:i + bulk_count]:
+                expired_conditions.append({
+                    'OP'   : 'raw',
+                    'RIGHT': sql.EXPR([
+                        { 'LEFT': 'originId', 'OP': '=',  'RIGHT': d['originId'] },
+                        { 'LEFT': 'seq',      'OP': '<=', 'RIGHT': d['expiredMaxSeq'] },
+                    ]),
+                })
+
+            sql.DELETE_FROM('biz_main_task_record_func')
+            sql.WHERE([ expired_conditions ])
+
+            self.db.query(sql)
+
     def flush_task_record(self):
         cache_key = toolkit.get_cache_key('dataBuffer', 'taskRecord')
 
@@ -406,12 +512,7 @@ class FlushDataBuffer(BaseInternalTask):
             return 0
 
         # Write to local DB
-        for d in cache_res:
-            sql = self.db.create_sql_builder()
-            sql.INSERT_INTO('biz_main_task_record')
-            sql.VALUES(d)
-
-            self.db.query(sql)
+        self._bulk_insert('biz_main_task_record', cache_res)
 
         # Roll DB data
         sql = self.db.create_sql_builder()
@@ -452,6 +553,7 @@ class FlushDataBuffer(BaseInternalTask):
 
         # Write to local DB
         origin_limit_map = {}
+        data_to_insert   = []
         for d in cache_res:
             origin    = d.get('origin')
             origin_id = d.get('originId')
@@ -469,36 +571,12 @@ class FlushDataBuffer(BaseInternalTask):
 
             # Write to DB
             if limit > 0:
-                sql = self.db.create_sql_builder()
-                sql.INSERT_INTO('biz_main_task_record_func')
-                sql.VALUES(d)
+                data_to_insert.append(d)
 
-                self.db.query(sql)
+        self._bulk_insert('biz_main_task_record_func', data_to_insert)
 
         # Roll DB data
-        for origin_id, limit in origin_limit_map.items():
-            sql = self.db.create_sql_builder()
-            sql.SELECT('seq', 'expiredMaxSeq')
-            sql.FROM('biz_main_task_record_func')
-            sql.WHERE({
-                'originId': origin_id,
-            })
-            sql.ORDER_BY('seq', 'DESC')
-            sql.LIMIT(1, limit)
-
-            db_res = self.db.query(sql)
-
-            if db_res:
-                expired_max_seq = db_res[0]['expiredMaxSeq']
-
-                sql = self.db.create_sql_builder()
-                sql.DELETE_FROM('biz_main_task_record_func')
-                sql.WHERE([
-                    { 'LEFT': 'originId', 'OP': '=',  'RIGHT': origin_id },
-                    { 'LEFT': 'seq',      'OP': '<=', 'RIGHT': expired_max_seq },
-                ])
-
-                self.db.query(sql)
+        self._roll_task_record_func(origin_limit_map)
 
         return len(cache_res)
 
@@ -823,6 +901,7 @@ class AutoClean(BaseInternalTask):
             ( toolkit.get_monitor_cache_key('heartbeat', 'workerOnQueue'),       CONFIG['_MONITOR_REPORT_EXPIRES'] ),
             ( toolkit.get_monitor_cache_key('heartbeat', 'workerCountOnQueue'),  CONFIG['_MONITOR_REPORT_EXPIRES'] ),
             ( toolkit.get_monitor_cache_key('heartbeat', 'processCountOnQueue'), CONFIG['_MONITOR_REPORT_EXPIRES'] ),
+            ( toolkit.get_monitor_cache_key('heartbeat', 'queueWaitOnWorker'),   CONFIG['_MONITOR_REPORT_EXPIRES'] ),
 
             # Service (pod) list
             ( toolkit.get_monitor_cache_key('heartbeat', 'serviceInfo'), CONFIG['_MONITOR_REPORT_EXPIRES'] ),
@@ -997,15 +1076,13 @@ class AutoBackupDB(BaseInternalTask):
 
     SQL_STR_TYPE_KEYWORDS = { 'char', 'text', 'blob' }
 
-    def get_table_dump_parts_for_mysql(self, table):
-        table_dumps_parts = []
-
-        # Drop table
-        sql = self.db.create_sql_builder()
-        sql.DROP_TABLE(table)
-
-        table_dumps_parts.append(str(sql))
+    # Rows per INSERT statement in dump
+    DUMP_INSERT_ROWS = 20
 
+    def iter_table_dump_parts_for_mysql(self, table):
+        '''
+        Yield parts of the table dump one by one, so that they can be written to file without collecting the whole dump
+        '''
         # Get create table SQL
         sql = self.db.create_sql_builder('''SHOW CREATE TABLE `??`''')
         sql_params = [ table ]
@@ -1013,12 +1090,19 @@ class AutoBackupDB(BaseInternalTask):
         if not db_res:
             return
 
-        table_dumps_parts.append(db_res[0]['Create Table'] + ';')
+        create_table_sql = db_res[0]['Create Table']
+
+        # Drop table
+        sql = self.db.create_sql_builder()
+        sql.DROP_TABLE(table)
+
+        yield str(sql)
+        yield create_table_sql + ';'
 
         # Do not backup the tables with limit / expire
         if table in CONFIG['_DBDATA_TABLE_LIMIT_MAP'] \
             or table in CONFIG['_DBDATA_TABLE_EXPIRE_MAP']:
-            return table_dumps_parts
+            return
 
         # Skip backuping data if no data in table
         sql = self.db.create_sql_builder()
@@ -1027,7 +1111,7 @@ class AutoBackupDB(BaseInternalTask):
         sql.LIMIT(1)
         db_res = self.db.query(sql)
         if not db_res:
-            return table_dumps_parts
+            return
 
         # Get table schema
         field_type_map = {}
@@ -1049,11 +1133,11 @@ class AutoBackupDB(BaseInternalTask):
                     field_type_map[field] = 'normal'
 
         # Backup data
-        table_dumps_parts.append('')
+        yield ''
 
         sql = '''LOCK TABLES `??` WRITE'''
         sql_params = [ table ]
-        table_dumps_parts.append(self.db.format_sql(sql, sql_params) + ';')
+        yield self.db.format_sql(sql, sql_params) + ';'
 
         select_fields = []
         for f, t in field_type_map.items():
@@ -1064,52 +1148,52 @@ class AutoBackupDB(BaseInternalTask):
 
         select_fields_sql = ', '.join(select_fields)
 
-        seq = 0
-        while True:
-            sql = self.db.create_sql_builder()
-            sql.SELECT(sql.RAW(select_fields_sql))
-            sql.FROM(table)
-            sql.WHERE({ 'LEFT': 'seq', 'OP': '>', 'RIGHT': seq })
-            sql.ORDER_BY('seq', 'ASC')
-            sql.LIMIT(20)
-            db_res = self.db.query(sql, sql_params)
-            if not db_res:
-                table_dumps_parts.append('''UNLOCK TABLES;''')
-                break
-
-            values = []
-            for d in db_res:
-                _d = []
-                for f in field_type_map.keys():
-                    v = d[f]
-                    t = field_type_map[f]
-                    if v is None:
-                        _d.append(None)
+        insert_fields = []
+        for f in field_type_map.keys():
+            insert_fields.append('`{0}`'.format(f))
 
-                    elif isinstance(v, arrow.Arrow):
-                        _d.append(v.format('YYYY-MM-DD HH:mm:ss'))
+        insert_fields_sql = ', '.join(insert_fields)
 
-                    else:
-                        if t == 'hexStr':
-                            _d.append(HexStr(v))
-                        else:
-                            _d.append(v)
+        def get_insert_sql(values):
+            sql = '''INSERT INTO `??` (??)\nVALUES\n  ?'''
+            sql_params = [ table, insert_fields_sql, values ]
+            return self.db.format_sql(sql, sql_params, pretty=True) + ';'
 
-                values.append(_d)
+        # Read all data in one streaming query
+        #   NOTE Use a dedicated connection, the pooled one is shared by other operations of the Worker process
+        sql = self.db.create_sql_builder()
+        sql.SELECT(sql.RAW(select_fields_sql))
+        sql.FROM(table)
+        sql.ORDER_BY('seq', 'ASC')
 
-            insert_fields = []
+        values = []
+        for d in self.db.query_iter(sql, dedicated=True):
+            _d = []
             for f in field_type_map.keys():
-                insert_fields.append('`{0}`'.format(f))
+                v = d[f]
+                t = field_type_map[f]
+                if v is None:
+                    _d.append(None)
 
-            insert_fields_sql = ', '.join(insert_fields)
+                elif isinstance(v, arrow.Arrow):
+                    _d.append(v.format('YYYY-MM-DD HH:mm:ss'))
 
-            sql = '''INSERT INTO `??` (??)\nVALUES\n  ?'''
-            sql_params = [ table, insert_fields_sql, values ]
-            table_dumps_parts.append(self.db.format_sql(sql, sql_params, pretty=True) + ';')
+                else:
+                    if t == 'hexStr':
+                        _d.append(HexStr(v))
+                    else:
+                        _d.append(v)
+
+            values.append(_d)
+
+            if len(values) >= self.DUMP_INSERT_ROWS:
+                yield get_insert_sql(values)
+                values = []
 
-            seq = db_res[-1]['seq']
+        if values:
+            yield get_insert_sql(values)
 
-        return table_dumps_parts
+        yield '''UNLOCK TABLES;'''
 
     def limit_backups(self):
         backup_dir = CONFIG['DB_AUTO_BACKUP_FOLDER_PATH']
@@ -1206,15 +1290,21 @@ class AutoBackupDB(BaseInternalTask):
                 table_dump_parts = None
 
                 if isinstance(self.db, FuncMySQLHelper):
-                    table_dump_parts = self.get_table_dump_parts_for_mysql(t)
+                    table_dump_parts = self.iter_table_dump_parts_for_mysql(t)
 
                 elif isinstance(self.db, FuncPostgreSQLHelper):
                     # TODO Dump PostgreSQL data
                     pass
 
                 if table_dump_parts:
-                    table_dumps = '\n'.join(table_dump_parts) + '\n\n'
-                    _f.write(table_dumps)
+                    # Write each part once produced
+                    is_dumped = False
+                    for part in table_dump_parts:
+                        _f.write(part + '\n')
+                        is_dumped = True
+
+                    if is_dumped:
+                        _f.write('\n')
 
         # Create .zip file
         zip_file_name = f"{CONFIG['_DB_AUTO_BACKUP_FILE_PREFIX']}{date_str}.zip"
@@ -1313,7 +1403,17 @@ class ReloadDataMD5Cache(BaseInternalTask):
         data_md5_cache_key = toolkit.get_cache_key('cache', 'dataMD5Cache', ['dataType', data_type])
 
         # Re-compute all if no ID specified
+        changed_data_ids = data_id
         if not data_id:
+            prev_data_md5_map = self.cache_db.hgetall(data_md5_cache_key) or {}
+
+            changed_data_ids = set(prev_data_md5_map.keys()) ^ set(data_md5_map.keys())
+            for _id, md5 in data_md5_map.items():
+                if _id in prev_data_md5_map and prev_data_md5_map[_id] != md5:
+                    changed_data_ids.add(_id)
+
+            changed_data_ids = list(changed_data_ids)
+
             self.cache_db.delete(data_md5_cache_key)
 
         if data_md5_map:
@@ -1324,6 +1424,10 @@ class ReloadDataMD5Cache(BaseInternalTask):
             # Clear cache if specified ID and no data
             self.cache_db.hdel(data_md5_cache_key, data_id)
 
+        # Notify worker processes to evict local cache
+        if changed_data_ids:
+            publish_data_md5_changed(self.cache_db, data_type, changed_data_ids)
+
     def run(self, **kwargs):
         lock_time  = kwargs.get('lockTime') or 0
         reload_all = kwargs.get('all')      or False
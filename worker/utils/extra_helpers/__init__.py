@@ -9,7 +9,7 @@ import xmltodict
 import requests
 
 # Project Modules
-from worker.utils import toolkit
+from worker.utils import toolkit, yaml_resources
 
 COMMON_SQL_ESCAPE_MAP = {
     '\0'  : '\\0',
@@ -34,6 +34,20 @@ POSTGRESQL_ESCAPE_MAP = {
     '\\'  : '\\\\',
 }
 
+def get_sys_db_pool_size():
+    '''
+    Max connections of the system DB pool in a Worker process
+    Threads below use the system DB concurrently, so one more connection for each of them
+    1. Func tasks in thread mode (`_WORKER_THREAD_CONCURRENCY_MAP`)
+    2. Thread pool for `DFF.AIO` helpers (`_FUNC_TASK_ASYNC_POOL_SIZE`), e.g. `DFF.AIO.STORE`
+    '''
+    CONFIG = yaml_resources.get('CONFIG')
+
+    pool_size = CONFIG['_DB_POOL_SIZE_WORKER']
+    pool_size += sum(map(int, (CONFIG['_WORKER_THREAD_CONCURRENCY_MAP'] or {}).values()))
+    pool_size += CONFIG['_FUNC_TASK_ASYNC_POOL_SIZE']
+    return pool_size
+
 class HexStr(str):
     pass
 
@@ -137,6 +151,149 @@ def format_sql(sql, sql_params=None, pretty=False, sql_escape=None):
     else:
         return result.strip()
 
+# Marker of values rendered by SQLBuilder in binding mode
+SQL_BIND_MARKER = '\x00?\x00'
+
+SQL_TEMPLATE_RE = re.compile('\x00\\?\x00|\\?+', re.M)
+
+def to_sql_bind_value(v):
+    if v is None or isinstance(v, (bool, int, float, bytes)):
+        return v
+
+    elif isinstance(v, HexStr):
+        return bytes.fromhex(v)
+
+    elif isinstance(v, str):
+        return v
+
+    else:
+        # Same as `common_sql_escape()`
+        return str(v)
+
+def compile_sql_template(sql):
+    '''
+    Split SQL into text chunks and slots
+    Slot types:
+        value  : Value from SQLBuilder (bind marker)
+        param  : `?`, value from SQL params
+        keyword: `??`, keyword from SQL params, always inlined
+    '''
+    chunks      = []
+    slots       = []
+    chunk_index = 0
+    for m in re.finditer(SQL_TEMPLATE_RE, sql):
+        placeholder = m.group()
+        if placeholder == SQL_BIND_MARKER:
+            slot = 'value'
+        elif placeholder == '?':
+            slot = 'param'
+        elif placeholder == '??':
+            slot = 'keyword'
+        else:
+            continue
+
+        start_index, end_index = m.span()
+        chunks.append(sql[chunk_index:start_index])
+        slots.append(slot)
+        chunk_index = end_index
+
+    chunks.append(sql[chunk_index:])
+
+    # `%` should be escaped when args are sent to the driver
+    escaped_chunks = [ chunk.replace('%', '%%') for chunk in chunks ]
+
+    return chunks, escaped_chunks, slots
+
+def bind_sql(sql, bind_values=None, sql_params=None, placeholder='%s'):
+    '''
+    Convert SQL to `(sql, args)` for `cursor.execute()`,
+    values are sent to the driver separately instead of escaping in Python
+    '''
+    bind_values = bind_values or []
+
+    if sql_params is None:
+        sql_params = []
+    elif not isinstance(sql_params, (list, tuple)):
+        sql_params = [ sql_params ]
+
+    chunks, escaped_chunks, slots = compile_sql_template(sql)
+    if not slots:
+        return sql.strip(), None
+
+    args          = []
+    fills         = []
+    escaped_fills = []
+
+    value_index = 0
+    param_index = 0
+    for slot in slots:
+        fill = None
+
+        if slot == 'value':
+            fill = placeholder
+            args.append(bind_values[value_index])
+            value_index += 1
+
+        elif param_index >= len(sql_params):
+            # No more params, keep as-is
+            fill = '?' if slot == 'param' else '??'
+
+        else:
+            sql_param = sql_params[param_index]
+            param_index += 1
+
+            if slot == 'keyword':
+                fill = str(sql_param)
+
+            elif isinstance(sql_param, (tuple, list, set)):
+                # Tuple, List -> %s, %s, ...
+                expressions = []
+                for x in sql_param:
+                    if isinstance(x, (tuple, list, set)):
+                        expressions.append(f"({', '.join([ placeholder ] * len(x))})")
+                        args.extend(to_sql_bind_value(v) for v in x)
+                    else:
+                        expressions.append(placeholder)
+                        args.append(to_sql_bind_value(x))
+
+                fill = ', '.join(expressions)
+
+            elif isinstance(sql_param, dict):
+                # Dict -> field = %s, ...
+                expressions = []
+                for k, v in sql_param.items():
+                    if v is None:
+                        expressions.append(f'{k} = NULL')
+                    else:
+                        expressions.append(f'{k} = {placeholder}')
+                        args.append(to_sql_bind_value(v))
+
+                fill = ', '.join(expressions)
+
+            else:
+                # Other -> %s
+                fill = placeholder
+                args.append(to_sql_bind_value(sql_param))
+
+        fills.append(fill)
+        escaped_fills.append(fill.replace('%', '%%') if slot == 'keyword' else fill)
+
+    if args:
+        parts = [ escaped_chunks[0] ]
+        for fill, chunk in zip(escaped_fills, escaped_chunks[1:]):
+            parts.append(fill)
+            parts.append(chunk)
+
+        return ''.join(parts).strip(), tuple(args)
+
+    else:
+        parts = [ chunks[0] ]
+        for fill, chunk in zip(fills, chunks[1:]):
+            parts.append(fill)
+            parts.append(chunk)
+
+        return ''.join(parts).strip(), None
+
 def to_dict_rows(cur, db_res):
     fields = [desc[0] for desc in cur.description]
     db_res_dict = None
@@ -145,6 +302,53 @@ def to_dict_rows(cur, db_res):
 
     return db_res_dict or db_res
 
+def to_bulk_rows(rows, chunk_size=None):
+    '''
+    Dict rows -> (columns, chunks of value tuples), missing values are None
+    '''
+    rows = toolkit.as_array(rows) or []
+    chunk_size = chunk_size or len(rows) or 1
+
+    columns = {}
+    for d in rows:
+        for k in d.keys():
+            columns[k] = True
+
+    columns = list(columns.keys())
+
+    def _iter_chunks():
+        for i in range(0, len(rows), chunk_size):
+            yield [ tuple(d.get(c) for c in columns) for d in rows[i:i + chunk_size] ]
+
+    return columns, _iter_chunks()
+
+def to_result_format(columns, rows, result_format):
+    '''
+    Tuple rows -> result in specified format
+        tuples   : { "columns": [ <Column>, ... ], "values": [ (<Value>, ...), ... ] }
+        columnar : { <Column>: [ <Value>, ... ], ... }
+        dataframe: pandas.DataFrame (pandas should be installed)
+    '''
+    if result_format == 'tuples':
+        return {
+            'columns': columns,
+            'values' : [ tuple(row) for row in rows ],
+        }
+
+    elif result_format == 'columnar':
+        if not rows:
+            return dict([ (c, []) for c in columns ])
+
+        return dict(zip(columns, [ list(values) for values in zip(*rows) ]))
+
+    elif result_format == 'dataframe':
+        import pandas
+        return pandas.DataFrame.from_records(rows, columns=columns)
+
+    else:
+        e = Exception(f'Unsupported result_format: {result_format}')
+        raise e
+
 def table_to_guance_dql_like_result(db_res):
     series_map = {}
 
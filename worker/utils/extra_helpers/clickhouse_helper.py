@@ -9,7 +9,7 @@ from dbutils.pooled_db import PooledDB
 
 # Project Modules
 from worker.utils import toolkit
-from worker.utils.extra_helpers import format_sql
+from worker.utils.extra_helpers import format_sql, to_bulk_rows, to_result_format
 
 def get_config(c):
     config = {
@@ -67,7 +67,7 @@ class ClickHouseHelper(object):
 
             raise
 
-    def query(self, sql, sql_params=None):
+    def query(self, sql, sql_params=None, result_format=None):
         sql = format_sql(sql, sql_params)
         debug_sql = toolkit.to_debug_text(sql)
 
@@ -84,10 +84,15 @@ class ClickHouseHelper(object):
             cur.execute(sql)
             db_res = cur.fetchall()
 
-            # tuple list -> dict list
             column_names = [c.name for c in cur.description]
-            for i, d in enumerate(db_res):
-                db_res[i] = dict(zip(column_names, d))
+            if result_format:
+                # Rows from cursor as-is
+                db_res = to_result_format(column_names, db_res, result_format)
+
+            else:
+                # tuple list -> dict list
+                for i, d in enumerate(db_res):
+                    db_res[i] = dict(zip(column_names, d))
 
         except Exception as e:
             stack_text = traceback.format_exc()
@@ -107,3 +112,89 @@ class ClickHouseHelper(object):
 
             if conn:
                 conn.close()
+
+    def query_iter(self, sql, sql_params=None, batch_size=1000):
+        '''
+        Query with streaming results,
+        rows are fetched in batches and yielded one by one
+        '''
+        sql = format_sql(sql, sql_params)
+        debug_sql = toolkit.to_debug_text(sql)
+
+        if not self.skip_log:
+            self.logger.debug('[CLICKHOUSE] Iter {}'.format(debug_sql))
+
+        conn = None
+        cur  = None
+
+        try:
+            conn = self.client.connection()
+            cur  = conn.cursor()
+
+            cur.set_stream_results(True, batch_size)
+            cur.execute(sql)
+
+            column_names = [c.name for c in cur.description]
+            while True:
+                db_res = cur.fetchmany(batch_size)
+                if not db_res:
+                    break
+
+                # tuple list -> dict list
+                for d in db_res:
+                    yield dict(zip(column_names, d))
+
+        except Exception as e:
+            stack_text = traceback.format_exc()
+            stack_text = re.sub('Stack trace:[\s\S]*', '', stack_text).strip()
+
+            for line in stack_text.splitlines():
+                self.logger.error(line)
+
+            raise Exception(stack_text)
+
+        finally:
+            if cur:
+                cur.close()
+
+            if conn:
+                conn.close()
+
+    def bulk_insert(self, table, rows, chunk_size=10000, on_conflict=None):
+        '''
+        Insert rows (list of dict) in chunks by native columnar INSERT
+        ClickHouse has no unique constraint, `on_conflict` is not supported
+        '''
+        if on_conflict is not None:
+            e = Exception(f'Unsupported on_conflict: {on_conflict}')
+            raise e
+
+        columns, chunks = to_bulk_rows(rows, chunk_size)
+        if not columns:
+            return 0
+
+        columns_sql = ', '.join([ f'`{c}`' for c in columns ])
+        sql = f'INSERT INTO {table} ({columns_sql}) VALUES'
+
+        if not self.skip_log:
+            self.logger.debug('[CLICKHOUSE] Bulk Insert {}'.format(sql))
+
+        count = 0
+
+        try:
+            for values in chunks:
+                # Rows -> Columns
+                data = [ list(col) for col in zip(*values) ]
+                count += self.driver.execute(sql, data, columnar=True) or 0
+
+        except Exception as e:
+            stack_text = traceback.format_exc()
+            stack_text = re.sub('Stack trace:[\s\S]*', '', stack_text).strip()
+
+            for line in stack_text.splitlines():
+                self.logger.error(line)
+
+            raise Exception(stack_text)
+
+        else:
+            return count
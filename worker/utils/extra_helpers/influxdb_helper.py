@@ -10,7 +10,7 @@ import arrow
 
 # Project Modules
 from worker.utils import toolkit
-from worker.utils.extra_helpers import format_sql
+from worker.utils.extra_helpers import format_sql, to_result_format
 
 def get_config(c):
     ssl = False
@@ -113,7 +113,7 @@ class InfluxDBHelper(object):
         else:
             return db_res
 
-    def query(self, sql, bind_params=None, database=None, dict_output=False):
+    def query(self, sql, bind_params=None, database=None, dict_output=False, result_format=None):
         debug_query = sql + ' '
         if bind_params:
             for k, v in bind_params.items():
@@ -143,7 +143,9 @@ class InfluxDBHelper(object):
             is_list = isinstance(db_res, (list, tuple))
             db_res = toolkit.as_array(db_res)
             db_res_list = None
-            if dict_output is False:
+            if result_format:
+                db_res_list = [self.convert_to_result_format(x, result_format) for x in db_res]
+            elif dict_output is False:
                 db_res_list = [x.raw for x in db_res]
             else:
                 db_res_list = [self.convert_to_dict(x) for x in db_res]
@@ -153,7 +155,7 @@ class InfluxDBHelper(object):
             else:
                 return db_res_list[0]
 
-    def query2(self, sql, sql_params=None, database=None, dict_output=False):
+    def query2(self, sql, sql_params=None, database=None, dict_output=False, result_format=None):
         sql = format_sql(sql, sql_params)
         debug_sql = toolkit.to_debug_text(sql)
 
@@ -172,7 +174,9 @@ class InfluxDBHelper(object):
             is_list = isinstance(db_res, (list, tuple))
             db_res = toolkit.as_array(db_res)
             db_res_list = None
-            if dict_output is False:
+            if result_format:
+                db_res_list = [self.convert_to_result_format(x, result_format) for x in db_res]
+            elif dict_output is False:
                 db_res_list = [x.raw for x in db_res]
             else:
                 db_res_list = [self.convert_to_dict(x) for x in db_res]
@@ -216,6 +220,34 @@ class InfluxDBHelper(object):
 
         return dict_db_res
 
+    def convert_to_result_format(self, db_res, result_format):
+        formatted_db_res = {
+            RESULT_SERIES_FIELD: []
+        }
+        for k, v in db_res.raw.items():
+            if k == RESULT_SERIES_FIELD:
+                continue
+
+            formatted_db_res[k] = v
+
+        if RESULT_SERIES_FIELD in db_res.raw:
+            for series in db_res.raw[RESULT_SERIES_FIELD]:
+                columns = list(series['columns'])
+                values  = series.get('values') or []
+
+                # Tags as extra columns
+                tags     = series.get('tags') or {}
+                tag_keys = [ k for k in tags.keys() if k not in columns ]
+                if tag_keys:
+                    tag_values = [ tags[k] for k in tag_keys ]
+
+                    columns += tag_keys
+                    values = [ list(row) + tag_values for row in values ]
+
+                formatted_db_res[RESULT_SERIES_FIELD].append(to_result_format(columns, values, result_format))
+
+        return formatted_db_res
+
     def get_ts_tags(self, point):
         possible_tags_fields = [k for k in point.keys() if k.endswith('tags')]
         possible_tags_fields.sort()
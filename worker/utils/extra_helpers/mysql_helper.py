@@ -7,17 +7,16 @@ import datetime
 import traceback
 
 # 3rd-party Modules
-import arrow
 import pymysql
-from pymysql.cursors import DictCursor
+from pymysql.cursors import Cursor, DictCursor, SSDictCursor
 from pymysql.constants import CLIENT as CLIENT_FLAG
 from dbutils.pooled_db import PooledDB
 import sqlparse
 
 # Project Modules
 from worker.utils import toolkit, yaml_resources
-from worker.utils.extra_helpers import format_sql, mysql_escape, table_to_guance_dql_like_result
-from worker.utils.extra_helpers.sql_builder import MySQLBuilder
+from worker.utils.extra_helpers import get_sys_db_pool_size, format_sql, mysql_escape, bind_sql, to_bulk_rows, to_result_format, table_to_guance_dql_like_result
+from worker.utils.extra_helpers.sql_builder import MySQLBuilder, SQLBindContext
 
 CONFIG = yaml_resources.get('CONFIG')
 
@@ -46,10 +45,19 @@ def get_config(c):
     }
     return config
 
+# Options for PooledDB only, not for the driver
+POOL_CONFIG_KEYS = [ 'maxusage', 'maxconnections', 'blocking', 'ping' ]
+
 CLIENT_CREATE_TIME = 0
 CLIENT_CONFIG      = None
 CLIENT             = None
 
+# Outcome of operations on system DB (shared in process, for health checking)
+CLIENT_STATUS = {
+    'lastOkTime'   : 0,
+    'lastErrorTime': 0,
+}
+
 class FuncMySQLHelper(object):
     db_name = 'MySQL'
 
@@ -58,6 +66,9 @@ class FuncMySQLHelper(object):
 
         self.skip_log = False
 
+        # Send values to the driver separately instead of formatting into SQL
+        self.bind_params = CONFIG['_DB_BIND_PARAMS']
+
         if config:
             if database:
                 config['database'] = database
@@ -88,7 +99,7 @@ class FuncMySQLHelper(object):
                     'password'      : CONFIG['MYSQL_PASSWORD'],
                     'database'      : CONFIG['MYSQL_DATABASE'],
                     'charset'       : CONFIG['_MYSQL_CHARSET'],
-                    'maxconnections': CONFIG['_DB_POOL_SIZE_WORKER'],
+                    'maxconnections': get_sys_db_pool_size(),
                 }
                 CLIENT = PooledDB(pymysql, **get_config(CLIENT_CONFIG))
 
@@ -118,6 +129,19 @@ class FuncMySQLHelper(object):
     def timezone(self):
         return self.config.get('timezone') or CONFIG.get('TIMEZONE')
 
+    @property
+    def client_status(self):
+        return CLIENT_STATUS
+
+    def _record_client_status(self, is_ok):
+        if self.client is not CLIENT:
+            return
+
+        if is_ok:
+            CLIENT_STATUS['lastOkTime'] = time.time()
+        else:
+            CLIENT_STATUS['lastErrorTime'] = time.time()
+
     def check(self):
         try:
             sql = self.create_sql_builder('SELECT 1')
@@ -129,6 +153,38 @@ class FuncMySQLHelper(object):
 
             raise
 
+    def dedicated_connection(self):
+        '''
+        Create a new connection outside the pool (should be closed by the caller)
+        '''
+        conn_config = get_config(self.config)
+        for k in POOL_CONFIG_KEYS:
+            conn_config.pop(k, None)
+
+        return pymysql.connect(**conn_config)
+
+    def probe(self):
+        '''
+        Check DB with a dedicated connection instead of the pool,
+        so that the check is not blocked by Tasks holding pooled connections
+        '''
+        conn = None
+        try:
+            conn = self.dedicated_connection()
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+                cur.fetchall()
+
+        except Exception as e:
+            for line in traceback.format_exc().splitlines():
+                self.logger.error(line)
+
+            raise
+
+        finally:
+            if conn:
+                conn.close()
+
     def tables(self):
         sql = self.create_sql_builder('SHOW TABLES')
 
@@ -252,22 +308,24 @@ class FuncMySQLHelper(object):
             raise
 
     def _convert_types(self, db_res):
+        if not db_res:
+            return db_res
+
+        # Plan by columns once, all rows share the same columns
+        json_columns = [ k for k in db_res[0].keys() if k.endswith('JSON') ]
+        if not json_columns:
+            return db_res
+
         for d in db_res:
-            for k, v in d.items():
+            for k in json_columns:
                 # JSON Fields to Objects
-                if k.endswith('JSON') and isinstance(v, str):
+                v = d.get(k)
+                if isinstance(v, str):
                     try:
                         d[k] = toolkit.json_loads(v)
                     except Exception as e:
                         pass
 
-                # Time Fields to Arrow Objects
-                if self.timezone and k.endswith('Time') and isinstance(v, (int, float)):
-                    try:
-                        d[k] = arrow.get(v, self.timezone)
-                    except Exception as e:
-                        pass
-
         return db_res
 
     def _prepare_sql(self, sql):
@@ -306,10 +364,41 @@ class FuncMySQLHelper(object):
 
         return ' '.join(sqls)
 
+    def _is_debug_log_enabled(self):
+        return not self.skip_log and self.logger.is_enabled_for('DEBUG')
+
+    def _get_debug_sql(self, sql, sql_args=None, cur=None):
+        # Render args into SQL for logs
+        if sql_args:
+            rendered = False
+            if cur:
+                try:
+                    sql = cur.mogrify(sql, sql_args)
+                except Exception as e:
+                    pass
+                else:
+                    rendered = True
+
+            if not rendered:
+                sql = f'{sql} -- Args: {sql_args!r}'
+
+        return toolkit.to_debug_text(sql)
+
+    def _compile_sql(self, sql, sql_params=None):
+        if not self.bind_params:
+            sql = self._prepare_sql(sql)
+            sql = self.format_sql(sql, sql_params)
+            return sql, None
+
+        # Values from SQLBuilder / SQL params are sent to the driver as args
+        with SQLBindContext() as bind_context:
+            sql = self._prepare_sql(sql)
+
+        sql_params = bind_context.params + (toolkit.as_array(sql_params) or [])
+        return bind_sql(sql, bind_context.values, sql_params)
+
     def _trans_execute(self, trans_conn, sql, sql_params=None):
-        sql       = self._prepare_sql(sql)
-        sql       = self.format_sql(sql, sql_params)
-        debug_sql = toolkit.to_debug_text(sql)
+        sql, sql_args = self._compile_sql(sql, sql_params)
 
         if not trans_conn:
             raise Exception('Transaction not started')
@@ -320,26 +409,27 @@ class FuncMySQLHelper(object):
         try:
             dt = toolkit.DiffTimer()
 
-            count  = cur.execute(sql)
+            count  = cur.execute(sql, sql_args)
             db_res = cur.fetchall()
 
-            if not self.skip_log:
-                self.logger.debug(f'[MYSQL] Trans Query {debug_sql} (Cost: {dt.tick()} ms)')
+            if self._is_debug_log_enabled():
+                self.logger.debug(f'[MYSQL] Trans Query {self._get_debug_sql(sql, sql_args, cur)} (Cost: {dt.tick()} ms)')
 
             db_res = list(db_res or [])
             if db_res:
                 db_res = self._convert_types(db_res)
 
+            self._record_client_status(True)
             return db_res, count
 
         except Exception as e:
-            self.logger.error(f'[MYSQL] Trans Query {debug_sql} (Cost: {dt.tick()} ms)')
+            self._record_client_status(False)
+
+            self.logger.error(f'[MYSQL] Trans Query {self._get_debug_sql(sql, sql_args, cur)} (Cost: {dt.tick()} ms)')
             raise
 
-    def _execute(self, sql, sql_params=None):
-        sql       = self._prepare_sql(sql)
-        sql       = self.format_sql(sql, sql_params)
-        debug_sql = toolkit.to_debug_text(sql)
+    def _execute(self, sql, sql_params=None, result_format=None):
+        sql, sql_args = self._compile_sql(sql, sql_params)
 
         conn = None
         cur  = None
@@ -348,30 +438,43 @@ class FuncMySQLHelper(object):
             dt = toolkit.DiffTimer()
 
             conn = self.client.connection()
-            cur  = conn.cursor()
+            if result_format:
+                # Tuple rows
+                cur = conn.cursor(Cursor)
+            else:
+                cur = conn.cursor()
 
-            count  = cur.execute(sql)
+            count  = cur.execute(sql, sql_args)
             db_res = cur.fetchall()
 
             conn.commit()
 
-            if not self.skip_log:
-                self.logger.debug(f'[MYSQL] Query `{debug_sql}` (Cost: {dt.tick()} ms)')
+            if self._is_debug_log_enabled():
+                self.logger.debug(f'[MYSQL] Query `{self._get_debug_sql(sql, sql_args, cur)}` (Cost: {dt.tick()} ms)')
 
-            db_res = list(db_res or [])
-            if db_res:
-                db_res = self._convert_types(db_res)
+            if result_format:
+                # Rows from cursor as-is
+                columns = [ d[0] for d in cur.description or [] ]
+                db_res  = to_result_format(columns, db_res or [], result_format)
 
+            else:
+                db_res = list(db_res or [])
+                if db_res:
+                    db_res = self._convert_types(db_res)
+
+            self._record_client_status(True)
             return db_res, count
 
         except Exception as e:
+            self._record_client_status(False)
+
             for line in traceback.format_exc().splitlines():
                 self.logger.error(line)
 
             if conn:
                 conn.rollback()
 
-            self.logger.error(f'[MYSQL] Query `{debug_sql}` (Cost: {dt.tick()} ms)')
+            self.logger.error(f'[MYSQL] Query `{self._get_debug_sql(sql, sql_args, cur)}` (Cost: {dt.tick()} ms)')
             raise
 
         finally:
@@ -389,14 +492,69 @@ class FuncMySQLHelper(object):
         result, count = self._trans_execute(trans_conn, sql, sql_params)
         return count
 
-    def query(self, sql, sql_params=None):
-        result, count = self._execute(sql, sql_params)
+    def query(self, sql, sql_params=None, result_format=None):
+        result, count = self._execute(sql, sql_params, result_format)
         return result
 
     def non_query(self, sql, sql_params=None):
         result, count = self._execute(sql, sql_params)
         return count
 
+    def query_iter(self, sql, sql_params=None, batch_size=1000, dedicated=False):
+        '''
+        Query with server-side cursor (SSDictCursor),
+        rows are fetched in batches and yielded one by one
+
+        dedicated: Use a connection outside the pool, for long streams not to hold a pooled connection
+        '''
+        sql, sql_args = self._compile_sql(sql, sql_params)
+
+        conn = None
+        cur  = None
+
+        try:
+            dt = toolkit.DiffTimer()
+
+            if dedicated:
+                conn = self.dedicated_connection()
+            else:
+                conn = self.client.connection()
+
+            cur = conn.cursor(SSDictCursor)
+
+            cur.execute(sql, sql_args)
+
+            if self._is_debug_log_enabled():
+                self.logger.debug(f'[MYSQL] Query Iter `{self._get_debug_sql(sql, sql_args, cur)}` (Cost: {dt.tick()} ms)')
+
+            while True:
+                db_res = cur.fetchmany(batch_size)
+                if not db_res:
+                    break
+
+                db_res = self._convert_types(list(db_res))
+                for d in db_res:
+                    yield d
+
+            self._record_client_status(True)
+
+        except Exception as e:
+            self._record_client_status(False)
+
+            for line in traceback.format_exc().splitlines():
+                self.logger.error(line)
+
+            self.logger.error(f'[MYSQL] Query Iter `{self._get_debug_sql(sql, sql_args, cur)}` (Cost: {dt.tick()} ms)')
+            raise
+
+        finally:
+            # NOTE Closing SSCursor reads and drops the rest rows
+            if cur:
+                cur.close()
+
+            if conn:
+                conn.close()
+
     def create_sql_builder(self, raw_sql=None):
         return MySQLBuilder(raw_sql).set_timezone(self.timezone)
 
@@ -464,3 +622,69 @@ class MySQLHelper(FuncMySQLHelper):
             sql = self.create_sql_builder(sql)
 
         return super()._prepare_sql(sql)
+
+    def bulk_insert(self, table, rows, chunk_size=1000, on_conflict=None):
+        '''
+        Insert rows (list of dict) in chunks by `executemany()`,
+        pymysql sends each chunk as one multi-row INSERT, and each chunk is committed
+
+        on_conflict:
+            None    : Raise error on duplicate key
+            'ignore': INSERT IGNORE
+            'update': ON DUPLICATE KEY UPDATE all columns
+        '''
+        columns, chunks = to_bulk_rows(rows, chunk_size)
+        if not columns:
+            return 0
+
+        sql = self.create_sql_builder()
+        table_sql     = str(sql.TABLE(table))
+        column_tokens = [ str(sql.FIELD(c)) for c in columns ]
+
+        if on_conflict is None or on_conflict == 'update':
+            insert_sql = 'INSERT INTO'
+        elif on_conflict == 'ignore':
+            insert_sql = 'INSERT IGNORE INTO'
+        else:
+            e = Exception(f'Unsupported on_conflict: {on_conflict}')
+            raise e
+
+        bulk_sql = f"{insert_sql} {table_sql} ({', '.join(column_tokens)}) VALUES ({', '.join([ '%s' ] * len(columns))})"
+        if on_conflict == 'update':
+            bulk_sql += f" ON DUPLICATE KEY UPDATE {', '.join([ f'{c} = VALUES({c})' for c in column_tokens ])}"
+
+        conn  = None
+        cur   = None
+        count = 0
+
+        try:
+            dt = toolkit.DiffTimer()
+
+            conn = self.client.connection()
+            cur  = conn.cursor()
+
+            for values in chunks:
+                count += cur.executemany(bulk_sql, values) or 0
+                conn.commit()
+
+            if not self.skip_log:
+                self.logger.debug(f'[MYSQL] Bulk Insert `{table}`, {count} affected (Cost: {dt.tick()} ms)')
+
+            return count
+
+        except Exception as e:
+            for line in traceback.format_exc().splitlines():
+                self.logger.error(line)
+
+            if conn:
+                conn.rollback()
+
+            self.logger.error(f'[MYSQL] Bulk Insert `{table}`, {count} affected (Cost: {dt.tick()} ms)')
+            raise
+
+        finally:
+            if cur:
+                cur.close()
+
+            if conn:
+                conn.close()
@@ -1,21 +1,22 @@
 # -*- coding: utf-8 -*-
 
 # Built-in Modules
+import io
 import re
 import time
 import traceback
 
 # 3rd-party Modules
-import arrow
 import psycopg2
+import psycopg2.extras
 from dbutils.pooled_db import PooledDB
 import sqlparse
 
 # Project Modules
 from worker.utils import toolkit, yaml_resources
-from worker.utils.extra_helpers import format_sql, postgresql_escape, table_to_guance_dql_like_result
-from worker.utils.extra_helpers import to_dict_rows
-from worker.utils.extra_helpers.sql_builder import PostgreSQLBuilder
+from worker.utils.extra_helpers import get_sys_db_pool_size, format_sql, postgresql_escape, bind_sql, table_to_guance_dql_like_result
+from worker.utils.extra_helpers import to_dict_rows, to_bulk_rows, to_result_format
+from worker.utils.extra_helpers.sql_builder import PostgreSQLBuilder, SQLBindContext
 
 CONFIG = yaml_resources.get('CONFIG')
 
@@ -33,13 +34,23 @@ def get_config(c):
         'connect_timeout': CONFIG['_DB_CONN_TIMEOUT'],
         'maxusage'       : CONFIG['_DB_POOL_MAX_USAGE'],
         'maxconnections': c.get('maxconnections') or 1,
+        'blocking'       : True,
     }
     return config
 
+# Options for PooledDB only, not for the driver
+POOL_CONFIG_KEYS = [ 'maxusage', 'maxconnections', 'blocking', 'ping' ]
+
 CLIENT_CREATE_TIME = 0
 CLIENT_CONFIG      = None
 CLIENT             = None
 
+# Outcome of operations on system DB (shared in process, for health checking)
+CLIENT_STATUS = {
+    'lastOkTime'   : 0,
+    'lastErrorTime': 0,
+}
+
 class FuncPostgreSQLHelper(object):
     db_name = 'PostgreSQL'
 
@@ -48,6 +59,9 @@ class FuncPostgreSQLHelper(object):
 
         self.skip_log = False
 
+        # Send values to the driver separately instead of formatting into SQL
+        self.bind_params = CONFIG['_DB_BIND_PARAMS']
+
         if config:
             if database:
                 config['database'] = database
@@ -79,7 +93,7 @@ class FuncPostgreSQLHelper(object):
                     'password'      : CONFIG['POSTGRESQL_PASSWORD'],
                     'database'      : CONFIG['POSTGRESQL_DATABASE'],
                     'encoding'      : CONFIG['_POSTGRESQL_ENCODING'],
-                    'maxconnections': CONFIG['_DB_POOL_SIZE_WORKER'],
+                    'maxconnections': get_sys_db_pool_size(),
                 }
                 CLIENT = PooledDB(psycopg2, **get_config(CLIENT_CONFIG))
 
@@ -109,6 +123,19 @@ class FuncPostgreSQLHelper(object):
     def timezone(self):
         return self.config.get('timezone') or CONFIG.get('TIMEZONE')
 
+    @property
+    def client_status(self):
+        return CLIENT_STATUS
+
+    def _record_client_status(self, is_ok):
+        if self.client is not CLIENT:
+            return
+
+        if is_ok:
+            CLIENT_STATUS['lastOkTime'] = time.time()
+        else:
+            CLIENT_STATUS['lastErrorTime'] = time.time()
+
     def check(self):
         try:
             sql = self.create_sql_builder('SELECT 1')
@@ -120,6 +147,38 @@ class FuncPostgreSQLHelper(object):
 
             raise
 
+    def dedicated_connection(self):
+        '''
+        Create a new connection outside the pool (should be closed by the caller)
+        '''
+        conn_config = get_config(self.config)
+        for k in POOL_CONFIG_KEYS:
+            conn_config.pop(k, None)
+
+        return psycopg2.connect(**conn_config)
+
+    def probe(self):
+        '''
+        Check DB with a dedicated connection instead of the pool,
+        so that the check is not blocked by Tasks holding pooled connections
+        '''
+        conn = None
+        try:
+            conn = self.dedicated_connection()
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+                cur.fetchall()
+
+        except Exception as e:
+            for line in traceback.format_exc().splitlines():
+                self.logger.error(line)
+
+            raise
+
+        finally:
+            if conn:
+                conn.close()
+
     def tables(self):
         sql = self.create_sql_builder('''
             SELECT
@@ -247,22 +306,24 @@ class FuncPostgreSQLHelper(object):
         conn.close()
 
     def _convert_types(self, db_res):
+        if not db_res:
+            return db_res
+
+        # Plan by columns once, all rows share the same columns
+        json_columns = [ k for k in db_res[0].keys() if k.endswith('JSON') ]
+        if not json_columns:
+            return db_res
+
         for d in db_res:
-            for k, v in d.items():
+            for k in json_columns:
                 # JSON Fields to Objects
-                if k.endswith('JSON') and isinstance(v, str):
+                v = d.get(k)
+                if isinstance(v, str):
                     try:
                         d[k] = toolkit.json_loads(v)
                     except Exception as e:
                         pass
 
-                # Time Fields to Arrow Objects
-                if self.timezone and k.endswith('Time') and isinstance(v, (int, float)):
-                    try:
-                        d[k] = arrow.get(v, self.timezone)
-                    except Exception as e:
-                        pass
-
         return db_res
 
     def _prepare_sql(self, sql):
@@ -301,10 +362,43 @@ class FuncPostgreSQLHelper(object):
 
         return ' '.join(sqls)
 
+    def _is_debug_log_enabled(self):
+        return not self.skip_log and self.logger.is_enabled_for('DEBUG')
+
+    def _get_debug_sql(self, sql, sql_args=None, cur=None):
+        # Render args into SQL for logs
+        if sql_args:
+            rendered = False
+            if cur:
+                try:
+                    sql = cur.mogrify(sql, sql_args)
+                    if isinstance(sql, bytes):
+                        sql = sql.decode()
+                except Exception as e:
+                    pass
+                else:
+                    rendered = True
+
+            if not rendered:
+                sql = f'{sql} -- Args: {sql_args!r}'
+
+        return toolkit.to_debug_text(sql)
+
+    def _compile_sql(self, sql, sql_params=None):
+        if not self.bind_params:
+            sql = self._prepare_sql(sql)
+            sql = self.format_sql(sql, sql_params)
+            return sql, None
+
+        # Values from SQLBuilder / SQL params are sent to the driver as args
+        with SQLBindContext() as bind_context:
+            sql = self._prepare_sql(sql)
+
+        sql_params = bind_context.params + (toolkit.as_array(sql_params) or [])
+        return bind_sql(sql, bind_context.values, sql_params)
+
     def _trans_execute(self, trans_conn, sql, sql_params=None):
-        sql       = self._prepare_sql(sql)
-        sql       = self.format_sql(sql, sql_params)
-        debug_sql = toolkit.to_debug_text(sql)
+        sql, sql_args = self._compile_sql(sql, sql_params)
 
         if not trans_conn:
             raise Exception('Transaction not started')
@@ -315,7 +409,7 @@ class FuncPostgreSQLHelper(object):
         try:
             dt = toolkit.DiffTimer()
 
-            cur.execute(sql)
+            cur.execute(sql, sql_args)
             count = cur.rowcount
 
             db_res = None
@@ -327,24 +421,25 @@ class FuncPostgreSQLHelper(object):
                 else:
                     raise
 
-            if not self.skip_log:
-                self.logger.debug(f'[POSTGRESQL] Trans Query `{debug_sql}` (Cost: {dt.tick()} ms)')
+            if self._is_debug_log_enabled():
+                self.logger.debug(f'[POSTGRESQL] Trans Query `{self._get_debug_sql(sql, sql_args, cur)}` (Cost: {dt.tick()} ms)')
 
             db_res = list(db_res or [])
             if db_res:
                 db_res = to_dict_rows(cur, db_res)
                 db_res = self._convert_types(db_res)
 
+            self._record_client_status(True)
             return db_res, count
 
         except Exception as e:
-            self.logger.error(f'[POSTGRESQL] Trans Query `{debug_sql}` (Cost: {dt.tick()} ms)')
+            self._record_client_status(False)
+
+            self.logger.error(f'[POSTGRESQL] Trans Query `{self._get_debug_sql(sql, sql_args, cur)}` (Cost: {dt.tick()} ms)')
             raise
 
-    def _execute(self, sql, sql_params=None):
-        sql       = self._prepare_sql(sql)
-        sql       = self.format_sql(sql, sql_params)
-        debug_sql = toolkit.to_debug_text(sql)
+    def _execute(self, sql, sql_params=None, result_format=None):
+        sql, sql_args = self._compile_sql(sql, sql_params)
 
         conn = None
         cur  = None
@@ -355,7 +450,7 @@ class FuncPostgreSQLHelper(object):
             conn = self.client.connection()
             cur  = conn.cursor()
 
-            cur.execute(sql)
+            cur.execute(sql, sql_args)
             count = cur.rowcount
 
             db_res = None
@@ -369,24 +464,33 @@ class FuncPostgreSQLHelper(object):
 
             conn.commit()
 
-            if not self.skip_log:
-                self.logger.debug(f'[POSTGRESQL] Query `{debug_sql}` (Cost: {dt.tick()} ms)')
+            if self._is_debug_log_enabled():
+                self.logger.debug(f'[POSTGRESQL] Query `{self._get_debug_sql(sql, sql_args, cur)}` (Cost: {dt.tick()} ms)')
 
-            db_res = list(db_res or [])
-            if db_res:
-                db_res = to_dict_rows(cur, db_res)
-                db_res = self._convert_types(db_res)
+            if result_format:
+                # Rows from cursor as-is
+                columns = [ d[0] for d in cur.description or [] ]
+                db_res  = to_result_format(columns, db_res or [], result_format)
 
+            else:
+                db_res = list(db_res or [])
+                if db_res:
+                    db_res = to_dict_rows(cur, db_res)
+                    db_res = self._convert_types(db_res)
+
+            self._record_client_status(True)
             return db_res, count
 
         except Exception as e:
+            self._record_client_status(False)
+
             for line in traceback.format_exc().splitlines():
                 self.logger.error(line)
 
             if conn:
                 conn.rollback()
 
-            self.logger.error(f'[POSTGRESQL] Query `{debug_sql}` (Cost: {dt.tick()} ms)')
+            self.logger.error(f'[POSTGRESQL] Query `{self._get_debug_sql(sql, sql_args, cur)}` (Cost: {dt.tick()} ms)')
             raise
 
         finally:
@@ -404,14 +508,71 @@ class FuncPostgreSQLHelper(object):
         result, count = self._trans_execute(trans_conn, sql, sql_params)
         return count
 
-    def query(self, sql, sql_params=None):
-        result, count = self._execute(sql, sql_params)
+    def query(self, sql, sql_params=None, result_format=None):
+        result, count = self._execute(sql, sql_params, result_format)
         return result
 
     def non_query(self, sql, sql_params=None):
         result, count = self._execute(sql, sql_params)
         return count
 
+    def query_iter(self, sql, sql_params=None, batch_size=1000, dedicated=False):
+        '''
+        Query with server-side cursor (named cursor),
+        rows are fetched in batches and yielded one by one
+
+        dedicated: Use a connection outside the pool, for long streams not to hold a pooled connection
+        '''
+        sql, sql_args = self._compile_sql(sql, sql_params)
+
+        conn = None
+        cur  = None
+
+        try:
+            dt = toolkit.DiffTimer()
+
+            if dedicated:
+                conn = self.dedicated_connection()
+            else:
+                conn = self.client.connection()
+
+            cur = conn.cursor(name=f'query_iter_{toolkit.gen_rand_string(8).lower()}')
+
+            cur.execute(sql, sql_args)
+
+            if self._is_debug_log_enabled():
+                self.logger.debug(f'[POSTGRESQL] Query Iter `{self._get_debug_sql(sql, sql_args, cur)}` (Cost: {dt.tick()} ms)')
+
+            while True:
+                db_res = cur.fetchmany(batch_size)
+                if not db_res:
+                    break
+
+                db_res = to_dict_rows(cur, db_res)
+                db_res = self._convert_types(db_res)
+                for d in db_res:
+                    yield d
+
+            self._record_client_status(True)
+
+        except Exception as e:
+            self._record_client_status(False)
+
+            for line in traceback.format_exc().splitlines():
+                self.logger.error(line)
+
+            self.logger.error(f'[POSTGRESQL] Query Iter `{self._get_debug_sql(sql, sql_args, cur)}` (Cost: {dt.tick()} ms)')
+            raise
+
+        finally:
+            if cur:
+                cur.close()
+
+            # Named cursor lives in a transaction
+            if conn:
+                conn.rollback()
+                conn.close()
+
     def create_sql_builder(self, raw_sql=None):
         return PostgreSQLBuilder(raw_sql).set_timezone(self.timezone)
 
@@ -479,3 +640,112 @@ class PostgreSQLHelper(FuncPostgreSQLHelper):
             sql = self.create_sql_builder(sql)
 
         return super()._prepare_sql(sql)
+
+    def _to_copy_text(self, v):
+        if v is None:
+            return '\\N'
+
+        elif isinstance(v, bool):
+            return 't' if v else 'f'
+
+        elif isinstance(v, (bytes, bytearray)):
+            return '\\\\x' + v.hex()
+
+        else:
+            if isinstance(v, (dict, list, tuple)):
+                # For JSON columns
+                v = toolkit.json_dumps(v)
+            else:
+                v = str(v)
+
+            return v.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def bulk_insert(self, table, rows, chunk_size=1000, on_conflict=None, conflict_columns=None):
+        '''
+        Insert rows (list of dict) in chunks, each chunk is committed
+        COPY is used when no conflict handling, otherwise multi-row INSERT by `execute_values()`
+
+        on_conflict:
+            None    : COPY, raise error on duplicate key
+            'ignore': ON CONFLICT DO NOTHING
+            'update': ON CONFLICT (<conflict_columns>) DO UPDATE all other columns
+        '''
+        columns, chunks = to_bulk_rows(rows, chunk_size)
+        if not columns:
+            return 0
+
+        sql = self.create_sql_builder()
+        table_sql     = str(sql.TABLE(table))
+        column_tokens = [ str(sql.FIELD(c)) for c in columns ]
+        columns_sql   = ', '.join(column_tokens)
+
+        bulk_sql = None
+        if on_conflict is None:
+            bulk_sql = f'COPY {table_sql} ({columns_sql}) FROM STDIN'
+
+        elif on_conflict == 'ignore':
+            bulk_sql = f'INSERT INTO {table_sql} ({columns_sql}) VALUES %s ON CONFLICT DO NOTHING'
+
+        elif on_conflict == 'update':
+            if not conflict_columns:
+                e = Exception('conflict_columns is required when on_conflict is `update`')
+                raise e
+
+            conflict_columns = toolkit.as_array(conflict_columns)
+            conflict_sql = ', '.join([ str(sql.FIELD(c)) for c in conflict_columns ])
+            update_sql   = ', '.join([ f'{str(sql.FIELD(c))} = EXCLUDED.{str(sql.FIELD(c))}' for c in columns if c not in conflict_columns ])
+            if update_sql:
+                bulk_sql = f'INSERT INTO {table_sql} ({columns_sql}) VALUES %s ON CONFLICT ({conflict_sql}) DO UPDATE SET {update_sql}'
+            else:
+                bulk_sql = f'INSERT INTO {table_sql} ({columns_sql}) VALUES %s ON CONFLICT ({conflict_sql}) DO NOTHING'
+
+        else:
+            e = Exception(f'Unsupported on_conflict: {on_conflict}')
+            raise e
+
+        conn  = None
+        cur   = None
+        count = 0
+
+        try:
+            dt = toolkit.DiffTimer()
+
+            conn = self.client.connection()
+            cur  = conn.cursor()
+
+            for values in chunks:
+                if on_conflict is None:
+                    copy_data = io.StringIO()
+                    for row in values:
+                        copy_data.write('\t'.join([ self._to_copy_text(v) for v in row ]) + '\n')
+
+                    copy_data.seek(0)
+                    cur.copy_expert(bulk_sql, copy_data)
+
+                else:
+                    psycopg2.extras.execute_values(cur, bulk_sql, values, page_size=len(values))
+
+                count += max(cur.rowcount, 0)
+                conn.commit()
+
+            if not self.skip_log:
+                self.logger.debug(f'[POSTGRESQL] Bulk Insert `{table}`, {count} affected (Cost: {dt.tick()} ms)')
+
+            return count
+
+        except Exception as e:
+            for line in traceback.format_exc().splitlines():
+                self.logger.error(line)
+
+            if conn:
+                conn.rollback()
+
+            self.logger.error(f'[POSTGRESQL] Bulk Insert `{table}`, {count} affected (Cost: {dt.tick()} ms)')
+            raise
+
+        finally:
+            if cur:
+                cur.close()
+
+            if conn:
+                conn.close()
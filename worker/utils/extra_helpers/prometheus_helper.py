@@ -9,7 +9,7 @@ import requests
 import arrow
 
 # Project Modules
-from . import parse_http_resp
+from . import parse_http_resp, to_result_format
 
 def get_config(c):
     config = {
@@ -65,7 +65,7 @@ class PrometheusHelper(object):
 
             raise
 
-    def query(self, method, path=None, query=None, body=None):
+    def query(self, method, path=None, query=None, body=None, result_format=None):
         if path is None:
             method, path = method.split(' ', 1)
 
@@ -103,8 +103,56 @@ class PrometheusHelper(object):
             e = Exception(r.status_code, r.text)
             raise e
 
+        if result_format:
+            return self.convert_to_result_format(parsed_resp, result_format)
+
         return parsed_resp
 
+    def _to_sample_value(self, v):
+        try:
+            return float(v)
+        except (TypeError, ValueError) as e:
+            return v
+
+    def convert_to_result_format(self, parsed_resp, result_format):
+        '''
+        Convert query result to one table: time, value, <Labels...>
+        '''
+        data = parsed_resp.get('data') or {}
+
+        result_type = data.get('resultType')
+        result      = data.get('result')
+
+        samples = None
+        if result_type == 'matrix':
+            samples = [ (r['metric'], r['values']) for r in result ]
+
+        elif result_type == 'vector':
+            samples = [ (r['metric'], [ r['value'] ]) for r in result ]
+
+        elif result_type in ( 'scalar', 'string' ):
+            samples = [ ({}, [ result ]) ]
+
+        else:
+            e = Exception(f'Unsupported result type for result_format: {result_type}')
+            raise e
+
+        columns = [ 'time', 'value' ]
+        for metric, values in samples:
+            for k in metric.keys():
+                if k not in columns:
+                    columns.append(k)
+
+        label_keys = columns[2:]
+
+        rows = []
+        for metric, values in samples:
+            labels = [ metric.get(k) for k in label_keys ]
+            for ts, v in values:
+                rows.append([ ts, self._to_sample_value(v) ] + labels)
+
+        return to_result_format(columns, rows, result_format)
+
     def guance_dql_like_query(self, query_statement, options=None):
         options = options or {}
 
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
 # Built-in Modules
+import os
 import time
 import traceback
 import functools
+import threading
 
 # 3rd-party Modules
 import redis
@@ -84,9 +86,98 @@ LUA_ZPOP_BELOW_LPUSH_ALL_SCRIPT = '''
     return count;
 '''
 
+LUA_LOCK_RELEASE_DELAYED_TASKS_SCRIPT = '''
+    local lockValue = redis.call("get", KEYS[1]);
+    if lockValue == false then
+        redis.call("set", KEYS[1], ARGV[1], "EX", ARGV[2]);
+    elseif lockValue == ARGV[1] then
+        redis.call("expire", KEYS[1], ARGV[2]);
+    else
+        return nil;
+    end
+
+    local limit = tonumber(ARGV[4]);
+    local res = {};
+    for i = 2, #KEYS, 2 do
+        local items = redis.call("zrangebyscore", KEYS[i], "-inf", ARGV[3], "LIMIT", 0, limit);
+        if #items > 0 then
+            redis.call("zremrangebyrank", KEYS[i], 0, #items - 1);
+            redis.call("lpush", KEYS[i + 1], unpack(items));
+        end
+        table.insert(res, #items);
+    end
+    return res;
+'''
+
+LUA_RPOP_MULTI_SCRIPT = '''
+    local count = tonumber(ARGV[1]);
+    local res = {};
+    for _, key in ipairs(KEYS) do
+        while count > 0 do
+            local item = redis.call("rpop", key);
+            if not item then
+                break;
+            end
+            table.insert(res, key);
+            table.insert(res, item);
+            count = count - 1;
+        end
+    end
+    return res;
+'''
+
 CLIENT_CONFIG = None
 CLIENT        = None
 
+# Outcome of operations on system Redis (shared in process, for health checking)
+CLIENT_STATUS = {
+    'lastOkTime'   : 0,
+    'lastErrorTime': 0,
+}
+
+# Time diff between local and system Redis (shared in process)
+SYS_TIME_DIFF = {
+    'pid'   : None,
+    'diffMs': None,
+}
+
+def get_time_diff_ms(client):
+    '''
+    Compute time diff between local and Redis, RTT compensated
+    '''
+    t0 = time.time()
+    redis_time = client.time()
+    t1 = time.time()
+
+    redis_time_ms = int(redis_time[0] * 1000 + redis_time[1] / 1000)
+    local_time_ms = int((t0 + t1) / 2 * 1000)
+    return local_time_ms - redis_time_ms
+
+def _calibrate_sys_time_diff():
+    while True:
+        time.sleep(CONFIG['_SYS_REDIS_TIME_CALIBRATE_INTERVAL'])
+
+        try:
+            SYS_TIME_DIFF['diffMs'] = get_time_diff_ms(CLIENT)
+
+        except Exception as e:
+            # Keep using the previous time diff
+            pass
+
+def get_sys_time_diff_ms():
+    '''
+    Compute time diff once in each process, and recalibrate in background
+    '''
+    pid = os.getpid()
+    if SYS_TIME_DIFF['pid'] != pid:
+        SYS_TIME_DIFF['diffMs'] = get_time_diff_ms(CLIENT)
+        SYS_TIME_DIFF['pid']    = pid
+
+        t = threading.Thread(target=_calibrate_sys_time_diff, daemon=True)
+        t.start()
+
+    return SYS_TIME_DIFF['diffMs']
+
 def on_connection_error(F):
     @functools.wraps(F)
     def _F(self, *args, **kwargs):
@@ -115,6 +206,10 @@ class RedisHelper(object):
 
         self.checked_keys = set()
 
+        # Pipeline for collecting commands
+        self.pipeline        = None
+        self.pipeline_thread = None
+
         if config:
             if database:
                 config['db'] = database
@@ -151,11 +246,8 @@ class RedisHelper(object):
             self.config = CLIENT_CONFIG
             self.client = CLIENT
 
-        # Get server time diff
-        redis_time = self.client.time()
-        redis_time_ms = int(redis_time[0] * 1000 + redis_time[1] / 1000)
-        local_time_ms = int(time.time() * 1000)
-        self.time_diff_ms = local_time_ms - redis_time_ms
+        # Server time diff (computed when needed)
+        self._time_diff_ms = None
 
     def __del__(self):
         if not self.client or self.client is CLIENT:
@@ -171,6 +263,19 @@ class RedisHelper(object):
         finally:
             self.client = None
 
+    @property
+    def client_status(self):
+        return CLIENT_STATUS
+
+    def _record_client_status(self, is_ok):
+        if self.client is not CLIENT:
+            return
+
+        if is_ok:
+            CLIENT_STATUS['lastOkTime'] = time.time()
+        else:
+            CLIENT_STATUS['lastErrorTime'] = time.time()
+
     def _convert_result(self, result):
         if isinstance(result, bytes):
             return six.ensure_str(result)
@@ -250,6 +355,45 @@ class RedisHelper(object):
             self.logger.error(f"[REDIS] Query `{_debug_str}` (Cost: {dt.tick()} ms)")
             raise
 
+    def begin_pipeline(self):
+        '''
+        Collect commands run in current thread, and send them in one round trip by `execute_pipeline()`
+        NOTE Commands collected in pipeline always return None
+        '''
+        if self.pipeline is not None:
+            return
+
+        self.pipeline        = self.client.pipeline(transaction=False)
+        self.pipeline_thread = threading.get_ident()
+
+    @on_connection_error
+    def execute_pipeline(self):
+        pipeline = self.pipeline
+
+        self.pipeline        = None
+        self.pipeline_thread = None
+
+        if pipeline is None or len(pipeline) == 0:
+            return []
+
+        command_count = len(pipeline)
+
+        try:
+            dt = toolkit.DiffTimer()
+            result = pipeline.execute()
+
+            if not self.skip_log:
+                self.logger.debug(f"[REDIS] Pipeline executed {command_count} command(s) (Cost: {dt.tick()} ms)")
+
+            return result
+
+        except Exception as e:
+            self.logger.error(f"[REDIS] Pipeline executed {command_count} command(s) (Cost: {dt.tick()} ms)")
+            raise
+
+        finally:
+            pipeline.reset()
+
     @on_connection_error
     def run(self, *args, **kwargs):
         command      = args[0]
@@ -257,6 +401,14 @@ class RedisHelper(object):
 
         _debug_str = self._get_debug_str(command, command_args, kwargs)
 
+        if self.pipeline is not None and self.pipeline_thread == threading.get_ident():
+            getattr(self.pipeline, command)(*command_args, **kwargs)
+
+            if not self.skip_log:
+                self.logger.debug(f"[REDIS] Pipeline `{_debug_str}`")
+
+            return None
+
         try:
             dt = toolkit.DiffTimer()
             result = getattr(self.client, command)(*command_args, **kwargs)
@@ -264,9 +416,12 @@ class RedisHelper(object):
             if not self.skip_log:
                 self.logger.debug(f"[REDIS] Run `{_debug_str}` (Cost: {dt.tick()} ms)")
 
+            self._record_client_status(True)
             return result
 
         except Exception as e:
+            self._record_client_status(False)
+
             self.logger.error(f"[REDIS] Run `{_debug_str}` (Cost: {dt.tick()} ms)")
             raise
 
@@ -280,6 +435,16 @@ class RedisHelper(object):
     def dbsize(self):
         return self.run('dbsize')
 
+    @property
+    def time_diff_ms(self):
+        if self.client is CLIENT:
+            return get_sys_time_diff_ms()
+
+        if self._time_diff_ms is None:
+            self._time_diff_ms = get_time_diff_ms(self.client)
+
+        return self._time_diff_ms
+
     # Generic
     def get_timestamp_ms(self):
         return int(time.time() * 1000) - self.time_diff_ms
@@ -537,6 +702,9 @@ class RedisHelper(object):
     def zrangebyscore(self, key, min_score='-inf', max_score='+inf', with_scores=False):
         return self._convert_result(self.run('zrangebyscore', key, min_score, max_score, withscores=with_scores))
 
+    def zcount(self, key, min_score='-inf', max_score='+inf'):
+        return self.run('zcount', key, min_score, max_score)
+
     # Pub
     def publish(self, topic, message):
         return self.run('publish', topic, message)
@@ -713,7 +881,7 @@ class RedisHelper(object):
         if not self.skip_log:
             self.logger.debug('[REDIS EXT] UNLOCK `{}`'.format(lock_key))
 
-        return self.client.eval(LUA_UNLOCK_SCRIPT, LUA_UNLOCK_SCRIPT_KEY_COUNT, lock_key, lock_value)
+        return self.run('eval', LUA_UNLOCK_SCRIPT, LUA_UNLOCK_SCRIPT_KEY_COUNT, lock_key, lock_value)
 
     @on_connection_error
     def ts_add(self, key, value, timestamp=None, mode=None):
@@ -850,6 +1018,43 @@ class RedisHelper(object):
 
         return self._convert_result(self.client.eval(LUA_ZPOP_BELOW_LPUSH_ALL_SCRIPT, LUA_ZPOP_LPUSH_SCRIPT_KEY_COUNT, key, dest_key, score))
 
+    @on_connection_error
+    def lock_release_delayed_tasks(self, lock_key, lock_value, max_lock_time, queue_pairs, score, limit):
+        '''
+        Acquire / renew the lock, and move up to `limit` elements (score <= `score`)
+        from each delay queue (ZSET) to its worker queue (LIST) in one round trip
+        `queue_pairs`: [ (<Delay Queue>, <Worker Queue>), ... ]
+        Return None if the lock is owned by others, otherwise moved count of each pair
+        '''
+        if not self.skip_log:
+            self.logger.debug('[REDIS EXT] LOCK RELEASE DELAYED TASKS `{}`, score: {}'.format(lock_key, score))
+
+        if max_lock_time <= 0:
+            max_lock_time = 1
+
+        keys = [ lock_key ]
+        for delay_queue, worker_queue in queue_pairs:
+            keys.extend([ delay_queue, worker_queue ])
+
+        return self._convert_result(self.client.eval(LUA_LOCK_RELEASE_DELAYED_TASKS_SCRIPT, len(keys), *keys,
+            lock_value, max_lock_time, score, max(int(limit), 1)))
+
+    @on_connection_error
+    def rpop_multi(self, keys, count):
+        '''
+        Pop up to `count` elements from lists in order of keys
+        Return [ (key, element), ... ]
+        '''
+        keys = toolkit.as_array(keys)
+        if not keys or not count or count <= 0:
+            return []
+
+        if not self.skip_log:
+            self.logger.debug('[REDIS EXT] RPOP MULTI `{}`, count: {}'.format(', '.join(keys), count))
+
+        res = self._convert_result(self.client.eval(LUA_RPOP_MULTI_SCRIPT, len(keys), *keys, count))
+        return list(zip(res[0::2], res[1::2]))
+
     @on_connection_error
     def put_tasks(self, task_reqs):
         task_reqs = toolkit.as_array(task_reqs)
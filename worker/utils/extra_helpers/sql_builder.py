@@ -1,6 +1,7 @@
 # Built-in Modules
 import json
 import datetime
+import threading
 
 # 3rd-party Modules
 import arrow
@@ -8,6 +9,33 @@ import arrow
 # Project Modules
 from worker.utils import toolkit
 from worker.utils.extra_helpers import format_sql, common_sql_escape, mysql_escape, postgresql_escape
+from worker.utils.extra_helpers import SQL_BIND_MARKER, to_sql_bind_value
+
+# Binding mode context of current thread
+BIND_CONTEXT = threading.local()
+
+class SQLBindContext(object):
+    '''
+    Render SQLBuilder in binding mode:
+    values are replaced by bind markers and collected in `values`,
+    params of `PARAM()` are collected in `params` instead of formatting into SQL
+    '''
+    def __init__(self):
+        self.values = []
+        self.params = []
+
+        self._prev_context = None
+
+    def __enter__(self):
+        self._prev_context = get_bind_context()
+        BIND_CONTEXT.current = self
+        return self
+
+    def __exit__(self, *args):
+        BIND_CONTEXT.current = self._prev_context
+
+def get_bind_context():
+    return getattr(BIND_CONTEXT, 'current', None)
 
 # SQL Token
 class SQLBaseToken(object):
@@ -98,18 +126,30 @@ class SQLValue(SQLBaseToken):
 
         self.value = value
 
+    def _to_token(self, value, token=None):
+        # Binding mode
+        bind_context = get_bind_context()
+        if bind_context:
+            bind_context.values.append(to_sql_bind_value(value))
+            return SQL_BIND_MARKER
+
+        if token is None:
+            token = self._sql_escape(value)
+
+        return token
+
     def to_like_pattern(self, mode=None):
         if isinstance(mode, str):
             mode = mode.lower()
 
         if '%' in self.value:
-            return self._sql_escape(self.value)
+            return self._to_token(self.value)
         elif mode == 'prelike':
-            return self._sql_escape(f"{self.value}%")
+            return self._to_token(f"{self.value}%")
         elif mode == 'suflike':
-            return self._sql_escape(f"%{self.value}")
+            return self._to_token(f"%{self.value}")
         else:
-            return self._sql_escape(f"%{self.value}%")
+            return self._to_token(f"%{self.value}%")
 
     def to_value_list(self):
         return list(map(lambda v: v if isinstance(v, self.__class__) else self.__class__(v), toolkit.as_array(self.value)))
@@ -119,13 +159,13 @@ class SQLValue(SQLBaseToken):
 
         if isinstance(self.value, bool):
             # token = 'TRUE' if self.value else 'FALSE'
-            token = '1' if self.value else '0'
+            token = self._to_token(int(self.value), '1' if self.value else '0')
 
         elif isinstance(self.value, (int, float)):
-            token = f'{self.value}'
+            token = self._to_token(self.value, f'{self.value}')
 
         elif isinstance(self.value, str):
-            token = self._sql_escape(self.value)
+            token = self._to_token(self.value)
 
         else:
             if self.value is None:
@@ -142,11 +182,11 @@ class SQLValue(SQLBaseToken):
                 _value = arrow.get(self.value)
                 if self._timezone is not None:
                     _value = _value.to(self._timezone)
-                token = self._sql_escape(_value.format('YYYY-MM-DD HH:mm:ss'))
+                token = self._to_token(_value.format('YYYY-MM-DD HH:mm:ss'))
 
             else:
                 # Other
-                token = self._sql_escape(self.value)
+                token = self._to_token(self.value)
 
         return token
 
@@ -953,7 +993,12 @@ class BaseSQLBuilder(object):
             raise
 
         if self.meta.get('params'):
-            sql = self.format_sql(sql, self.meta['params'])
+            bind_context = get_bind_context()
+            if bind_context:
+                # Binding mode, params are sent to the driver with other values
+                bind_context.params.extend(self.meta['params'])
+            else:
+                sql = self.format_sql(sql, self.meta['params'])
 
         sql += ';'
         return sql
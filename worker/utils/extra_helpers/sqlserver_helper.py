@@ -10,7 +10,7 @@ from dbutils.pooled_db import PooledDB
 # Project Modules
 from worker.utils import toolkit
 from worker.utils.extra_helpers import format_sql
-from worker.utils.extra_helpers import to_dict_rows
+from worker.utils.extra_helpers import to_dict_rows, to_bulk_rows
 
 def get_config(c):
     config = {
@@ -189,3 +189,98 @@ class SQLServerHelper(object):
     def non_query(self, sql, sql_params=None):
         result, count = self._execute(sql, sql_params)
         return count
+
+    def query_iter(self, sql, sql_params=None, batch_size=1000):
+        '''
+        Query and fetch rows in batches,
+        rows are yielded one by one
+        '''
+        sql = format_sql(sql, sql_params)
+        debug_sql = toolkit.to_debug_text(sql)
+
+        if not self.skip_log:
+            self.logger.debug('[SQLSERVER] Query Iter `{}`'.format(debug_sql))
+
+        conn = None
+        cur  = None
+
+        try:
+            conn = self.client.connection()
+            cur  = conn.cursor()
+
+            cur.execute(sql)
+
+            while True:
+                db_res = cur.fetchmany(batch_size)
+                if not db_res:
+                    break
+
+                db_res = to_dict_rows(cur, list(db_res))
+                for d in db_res:
+                    yield d
+
+        except Exception as e:
+            for line in traceback.format_exc().splitlines():
+                self.logger.error(line)
+
+            raise
+
+        finally:
+            if cur:
+                cur.close()
+
+            if conn:
+                conn.close()
+
+    def bulk_insert(self, table, rows, chunk_size=1000, on_conflict=None):
+        '''
+        Insert rows (list of dict) in chunks by `executemany()`,
+        pymssql runs the INSERT for each row in one connection, and each chunk is committed
+        `on_conflict` is not supported
+        '''
+        if on_conflict is not None:
+            e = Exception(f'Unsupported on_conflict: {on_conflict}')
+            raise e
+
+        columns, chunks = to_bulk_rows(rows, chunk_size)
+        if not columns:
+            return 0
+
+        columns_sql = ', '.join([ f'[{c}]' for c in columns ])
+        values_sql  = ', '.join([ '%s' ] * len(columns))
+        sql = f'INSERT INTO {table} ({columns_sql}) VALUES ({values_sql})'
+
+        if not self.skip_log:
+            self.logger.debug('[SQLSERVER] Bulk Insert `{}`'.format(sql))
+
+        conn  = None
+        cur   = None
+        count = 0
+
+        try:
+            conn = self.client.connection()
+            cur  = conn.cursor()
+
+            for values in chunks:
+                cur.executemany(sql, values)
+                count += max(cur.rowcount, 0)
+                conn.commit()
+
+        except Exception as e:
+            for line in traceback.format_exc().splitlines():
+                self.logger.error(line)
+
+            if conn:
+                conn.rollback()
+
+            raise
+
+        else:
+            return count
+
+        finally:
+            if cur:
+                cur.close()
+
+            if conn:
+                conn.close()
@@ -313,6 +313,12 @@ class LogHelper(object):
 
                 self.level = 'ALL'
 
+    def is_enabled_for(self, level):
+        if self.level == 'ALL':
+            return True
+
+        return LOG_LEVELS['levels'][level.upper()] <= LOG_LEVELS['levels'][self.level]
+
     def __getattr__(self, level):
         if level.upper() not in LOG_LEVELS['levels']:
             raise AttributeError(f"'{self.__class__.__name__}' does not support the level '{level}'")
@@ -18,6 +18,8 @@ import base64
 import math
 import pprint
 import functools
+import calendar
+import bisect
 
 try:
     from urllib import urlencode
@@ -134,6 +136,65 @@ def get_memory_usage():
     memory_usage = p.memory_full_info().uss
     return memory_usage
 
+def _read_sys_file(file_path):
+    if not os.path.exists(file_path):
+        return None
+
+    with open(file_path, 'r') as _f:
+        return _f.read().strip()
+
+def get_cpu_limit():
+    '''
+    Get the CPU limit (cores) from cgroup, use the CPU count if not limited
+    '''
+    cpu_count = float(os.cpu_count() or 1)
+
+    try:
+        # cgroup v2
+        cpu_max = _read_sys_file('/sys/fs/cgroup/cpu.max')
+        if cpu_max:
+            quota, period = cpu_max.split()[:2]
+            if quota != 'max':
+                return min(int(quota) / int(period), cpu_count)
+
+            return cpu_count
+
+        # cgroup v1
+        quota  = _read_sys_file('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+        period = _read_sys_file('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+        if quota and period and int(quota) > 0:
+            return min(int(quota) / int(period), cpu_count)
+
+    except Exception as e:
+        pass
+
+    return cpu_count
+
+def get_memory_limit():
+    '''
+    Get the memory limit (bytes) from cgroup, use the total memory if not limited
+    '''
+    memory_total = psutil.virtual_memory().total
+
+    try:
+        # cgroup v2
+        memory_max = _read_sys_file('/sys/fs/cgroup/memory.max')
+        if memory_max:
+            if memory_max != 'max':
+                return min(int(memory_max), memory_total)
+
+            return memory_total
+
+        # cgroup v1 (unlimited is shown as a huge number)
+        memory_max = _read_sys_file('/sys/fs/cgroup/memory/memory.limit_in_bytes')
+        if memory_max:
+            return min(int(memory_max), memory_total)
+
+    except Exception as e:
+        pass
+
+    return memory_total
+
 def get_attr(obj, attr, default=None):
     if hasattr(obj, attr):
         return obj.__getattribute__(attr)
@@ -848,8 +909,10 @@ class LocalCache(object):
         if not self.expires:
             return
 
-        if key in self.__data:
-            self.__data[key]['ts'] = time.time() + self.expires
+        # NOTE Items may be removed by other threads at any time
+        elem = self.__data.get(key)
+        if elem:
+            elem['ts'] = time.time() + self.expires
 
     def clean(self):
         if not self.expires:
@@ -858,7 +921,7 @@ class LocalCache(object):
         now = time.time()
         for key in list(self.__data.keys()):
             elem = self.__data.get(key)
-            if now - elem['ts'] > self.expires:
+            if elem and now - elem['ts'] > self.expires:
                 self.__data.pop(key, None)
 
     def keys(self):
@@ -895,6 +958,9 @@ class LocalCache(object):
         except KeyError as e:
             pass
 
+    def clear(self):
+        self.__data.clear()
+
 def mask_auth_url(s):
     try:
         return RE_HTTP_BASIC_AUTH_MASK.sub(RE_HTTP_BASIC_AUTH_MASK_REPLACE, s)
@@ -914,22 +980,212 @@ def to_croniter_style(cron_expr):
 
     return ' '.join(parts)
 
+class CompiledCronExpr(object):
+    '''
+    Cron expression compiled into bitmasks of each field
+    Parsing is done by croniter, matching / searching / counting are done by bit operations.
+    '''
+    def __init__(self, cron_expr):
+        expanded, nth_weekday_of_month = croniter.expand(to_croniter_style(cron_expr))
+
+        # Fields in croniter style: minute, hour, day, month, weekday, second
+        self.minute_mask = self._to_mask(expanded[0], 0, 59)
+        self.hour_mask   = self._to_mask(expanded[1], 0, 23)
+        self.day_mask    = self._to_mask(expanded[2], 1, 31)
+        self.month_mask  = self._to_mask(expanded[3], 1, 12)
+        self.second_mask = self._to_mask(expanded[5], 0, 59)
+
+        # Weekday: 0 and 7 are both Sunday
+        self.weekday_mask = self._to_mask(expanded[4], 0, 7)
+        if self.weekday_mask & (1 << 7):
+            self.weekday_mask |= 1
+
+        # Last day of month (`L` in day field)
+        self.has_last_day = 'l' in expanded[2]
+
+        # Nth weekday of month (`#` in weekday field)
+        self.nth_weekdays = {}
+        for weekday, nth in nth_weekday_of_month.items():
+            weekdays = range(0, 7) if weekday == '*' else [ int(weekday) % 7 ]
+            for w in weekdays:
+                self.nth_weekdays.setdefault(w, set()).update(nth)
+                self.weekday_mask &= ~(1 << w)
+
+        # Day / weekday are OR-ed when both specified
+        self.is_day_or = expanded[2][0] != '*' and expanded[4][0] != '*'
+
+        self.minutes = self._to_list(self.minute_mask, 0, 59)
+        self.hours   = self._to_list(self.hour_mask,   0, 23)
+        self.seconds = self._to_list(self.second_mask, 0, 59)
+
+    def _to_mask(self, values, low, high):
+        if values == [ '*' ]:
+            values = range(low, high + 1)
+
+        mask = 0
+        for v in values:
+            if isinstance(v, int) or str(v).isdigit():
+                mask |= 1 << int(v)
+
+        return mask
+
+    def _to_list(self, mask, low, high):
+        return [ v for v in range(low, high + 1) if mask & (1 << v) ]
+
+    def is_match_date(self, year, month, day):
+        if not self.month_mask & (1 << month):
+            return False
+
+        last_day = calendar.monthrange(year, month)[1]
+        weekday  = (calendar.weekday(year, month, day) + 1) % 7 # 0 = Sunday
+
+        day_matched = bool(self.day_mask & (1 << day)) or (self.has_last_day and day == last_day)
+
+        weekday_matched = bool(self.weekday_mask & (1 << weekday))
+        if not weekday_matched and weekday in self.nth_weekdays:
+            for n in self.nth_weekdays[weekday]:
+                if n == 'l' and day + 7 > last_day:
+                    weekday_matched = True
+                elif n != 'l' and (day - 1) // 7 + 1 == int(n):
+                    weekday_matched = True
+
+        if self.is_day_or:
+            return day_matched or weekday_matched
+        else:
+            return day_matched and weekday_matched
+
+    def is_match(self, t, tz):
+        year, month, day, hour, minute, second = get_cron_local_time(t, tz)
+
+        return bool(self.second_mask & (1 << second)) \
+            and bool(self.minute_mask & (1 << minute)) \
+            and bool(self.hour_mask & (1 << hour)) \
+            and self.is_match_date(year, month, day)
+
+    def iter_dates(self, t, tz, max_days):
+        date = arrow.get(t).to(tz).date()
+        for i in range(max_days):
+            if self.is_match_date(date.year, date.month, date.day):
+                yield date
+
+            date += datetime.timedelta(days=1)
+
+    def iter_times_of_day(self, hour=0, minute=0):
+        '''
+        Iterate (hour, minute) of a day from hour:minute (inclusive)
+        '''
+        i = bisect.bisect_left(self.hours, hour)
+        if i < len(self.hours) and self.hours[i] == hour:
+            for m in self.minutes[bisect.bisect_left(self.minutes, minute):]:
+                yield hour, m
+
+            i += 1
+
+        for h in self.hours[i:]:
+            for m in self.minutes:
+                yield h, m
+
+    def get_next_time(self, t, tz, max_days=366 * 5):
+        '''
+        Get the next minute-aligned time (>= t), second field is ignored
+        '''
+        year, month, day, hour, minute, second = get_cron_local_time(t, tz)
+
+        # Skip current minute if t is not at the start of it
+        if second > 0 or t != int(t):
+            minute += 1
+
+        for date in self.iter_dates(t, tz, max_days):
+            if (date.year, date.month, date.day) == (year, month, day):
+                times = self.iter_times_of_day(hour, minute)
+            else:
+                times = self.iter_times_of_day()
+
+            for h, m in times:
+                # NOTE Wall-clock time may be shifted by DST, so check the timestamp anyway
+                next_time = arrow.Arrow(date.year, date.month, date.day, h, m, tzinfo=tz).int_timestamp
+                if next_time >= t:
+                    return next_time
+
+        e = Exception(f'No matched time in {max_days} days')
+        raise e
+
+    def count(self, start_time, end_time, tz):
+        '''
+        Count the trigger times in [start_time, end_time)
+        '''
+        if end_time <= start_time:
+            return 0
+
+        count = 0
+        max_days = int((end_time - start_time) / (24 * 3600)) + 2
+        for date in self.iter_dates(start_time, tz, max_days):
+            day_start = arrow.Arrow(date.year, date.month, date.day, tzinfo=tz)
+            if day_start.int_timestamp >= end_time:
+                break
+
+            day_end = day_start.shift(days=1)
+            if start_time <= day_start.int_timestamp and day_end.int_timestamp <= end_time:
+                # Whole day in range
+                count += len(self.hours) * len(self.minutes) * len(self.seconds)
+                continue
+
+            for hour in self.hours:
+                hour_start = day_start.replace(hour=hour).int_timestamp
+                if hour_start + 3600 <= start_time or hour_start >= end_time:
+                    continue
+
+                if start_time <= hour_start and hour_start + 3600 <= end_time:
+                    # Whole hour in range
+                    count += len(self.minutes) * len(self.seconds)
+                    continue
+
+                for minute in self.minutes:
+                    minute_start = hour_start + minute * 60
+                    for second in self.seconds:
+                        if start_time <= minute_start + second < end_time:
+                            count += 1
+
+        return count
+
+@functools.lru_cache(maxsize=4096)
+def compile_cron_expr(cron_expr):
+    return CompiledCronExpr(cron_expr)
+
 @functools.lru_cache(maxsize=128)
+def get_cron_local_time(t, tz):
+    at = arrow.get(t).to(tz)
+    return at.year, at.month, at.day, at.hour, at.minute, at.second
+
 def is_valid_cron_expr(cron_expr):
     if not cron_expr:
         return False
 
-    cron_expr = to_croniter_style(cron_expr)
-    return croniter.is_valid(cron_expr)
+    try:
+        compile_cron_expr(cron_expr)
+    except Exception as e:
+        return False
+    else:
+        return True
 
-@functools.lru_cache(maxsize=128)
 def is_match_cron_expr(cron_expr, t, tz):
     if t is None:
-        raise Exception(f'This function use @functools.lru_cache, so parameter `t` should not be `None`')
+        raise Exception(f'Parameter `t` should not be `None`')
 
-    cron_expr = to_croniter_style(cron_expr)
-    at = arrow.get(t).to(tz)
-    return croniter.match(cron_expr, at.datetime)
+    return compile_cron_expr(cron_expr).is_match(t, tz)
+
+def get_next_cron_time(cron_expr, t, tz):
+    '''
+    Get the next minute-aligned time (>= t) which matches the Cron expression
+    NOTE Second field is ignored
+    '''
+    return compile_cron_expr(cron_expr).get_next_time(t, tz)
+
+def count_cron_triggers(cron_expr, start_time, end_time, tz):
+    '''
+    Count the trigger times of the Cron expression in [start_time, end_time)
+    '''
+    return compile_cron_expr(cron_expr).count(start_time, end_time, tz)
 
 class DiffTimer(object):
     def __init__(self):